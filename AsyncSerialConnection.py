@@ -0,0 +1,32 @@
+# AsyncSerialConnection
+#
+#   SerialConnection driven by an asyncio event loop.  Instead of sleeping and then draining the port,
+#   the loop watches the tty's file descriptor and every read goes straight into the stream observable
+#   (e.g. streamData) as soon as bytes are waiting -- so the UART buffer never fills between polls.
+#
+
+import asyncio
+
+from SerialConnection import SerialConnection
+
+
+class AsyncSerialConnection(SerialConnection):
+    def __init__(self, device):
+        super().__init__(device)
+        self.stream = None
+        self.loop = None
+
+    # start feeding stream from the running loop (or loop, if given)
+    def attach(self, stream, loop=None):
+        self.stream = stream
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+
+        self.loop.add_reader(self.ser.fileno(), self.onReadable)
+
+    def detach(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.ser.fileno())
+            self.loop = None
+
+    def onReadable(self):
+        self.stream.append(self.listen())
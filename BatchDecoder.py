@@ -0,0 +1,224 @@
+# BatchDecoder
+#
+#   Decodes a whole buffer at once -- e.g. months of capture mapped into memory -- rather than one
+#   read at a time through PentairStream.
+#
+#   frameSpans() finds the frames in the buffer (offset and length) by trusting each length byte,
+#   validMask() checks all their checksums in one go, and the valid ones are decoded. At a frame that
+#   fails, BatchDecoder resyncs inside it just as StreamDeframer does, then carries on in batches --
+#   so it finds the same frames, and counts the same stats, as StreamDeframer and parseFrame would.
+#   decodeChunk() does the same for a stream read in large chunks, carrying the partial frame (and a
+#   corrupted span) over like StreamDeframer -- ShardDecoder (pentair-decode.py) and
+#   pentair-analyze.py decode captures with it. Live traffic still goes through
+#   PentairProtocol.parseFrame one frame at a time.
+#
+#   NumPy is optional.  With it, validMask() takes a running sum over a uint8 view of each window of
+#   the buffer, so the sum of any frame is the difference of two entries.  Without it the buffer is
+#   scanned and checked frame by frame, like StreamDeframer, with no separate mask.
+#
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from PentairProtocol import PentairProtocol
+from PentairStream import StreamDeframer
+
+
+# bytes of frames per running sum -- validMask needs 4 bytes of scratch per byte of window
+MASK_WINDOW = 1 << 20
+
+# bytes of buffer frameSpans is asked for at a time -- a corrupted frame that throws the spans out of
+# step only costs the rest of its window
+#   (after noise that does, the next MIN_SPAN_WINDOW bytes are scanned frame by frame, and clean
+#   windows grow back from there)
+SPAN_WINDOW = 1 << 14
+MIN_SPAN_WINDOW = 1 << 10
+
+
+# (offsets, lengths, end) of the whole frames in buffer[start:end] -- end is where scanning stopped,
+# i.e. the start of a trailing partial frame (or the end of the buffer)
+def frameSpans(buffer, start=0, end=None):
+    n = len(buffer) if end is None else end
+    offsets = array('Q')
+    lengths = array('H')
+
+    pos = start
+    while True:
+        s = buffer.find(PentairProtocol.START_BYTE, pos, n)
+        if s < 0:
+            pos = n
+            break
+
+        if s + PentairProtocol.HEADER_LENGTH > n:
+            pos = s
+            break
+
+        length = PentairProtocol.HEADER_LENGTH + buffer[s + PentairProtocol.LENGTH_OFFSET] + \
+                    PentairProtocol.CHECKSUM_LENGTH
+        if s + length > n:
+            pos = s
+            break
+
+        offsets.append(s)
+        lengths.append(length)
+        pos = s + length
+
+    return (offsets, lengths, pos)
+
+
+# a mask (truthy per frame) of the frames with a START_BYTE and a good checksum
+def validMask(buffer, offsets, lengths):
+    if np is None:
+        mask = []
+        for o, l in zip(offsets, lengths):
+            e = o + l
+            mask.append(l >= PentairProtocol.HEADER_LENGTH + PentairProtocol.CHECKSUM_LENGTH and
+                        buffer[o] == PentairProtocol.START_BYTE and
+                        (buffer[e - 2] << 8) + buffer[e - 1] == sum(buffer[o:e - 2]))
+        return mask
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    starts = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = starts + lengths
+
+    checksums = (data[ends - 2].astype(np.uint32) << 8) | data[ends - 1]
+    summed = np.zeros(len(starts), dtype=bool)
+
+    # one running sum per window of frames, over just the bytes they cover -- sums[i] is the total
+    # of the window up to i. uint32 never wraps within a window
+    i = 0
+    while i < len(starts):
+        j = max(int(np.searchsorted(starts, starts[i] + MASK_WINDOW)), i + 1)
+        base = starts[i]
+        top = ends[i:j].max()
+
+        sums = np.zeros(top - base + 1, dtype=np.uint32)
+        np.cumsum(data[base:top], dtype=np.uint32, out=sums[1:])
+        summed[i:j] = sums[ends[i:j] - 2 - base] - sums[starts[i:j] - base] == checksums[i:j]
+        i = j
+
+    return (lengths >= PentairProtocol.HEADER_LENGTH + PentairProtocol.CHECKSUM_LENGTH) & \
+        (data[starts] == PentairProtocol.START_BYTE) & summed
+
+
+class BatchDecoder:
+    def __init__(self, protocol=None):
+        self.protocol = PentairProtocol() if protocol is None else protocol
+        # scans (and counts) the corrupted spans
+        self.deframer = StreamDeframer(protocol=self.protocol)
+        # the partial frame at the end of the last chunk (decodeChunk)
+        self.carry = b''
+
+    # the Frames completed by chunk -- the partial frame at its end (and the corrupted span it may be
+    # in) carries over to the next call, as with StreamDeframer.frames
+    def decodeChunk(self, chunk):
+        buffer = self.carry + chunk if len(self.carry) > 0 else chunk
+        frames, pos = self.decode(buffer, resume=True)
+        self.carry = bytes(buffer[pos:])
+
+        return frames
+
+    # Frames for the valid frames in buffer, and where the trailing partial frame (if any) starts
+    #   buffer must not change while the Frames are in use -- their payloads are views into it
+    #   resume -- carry on from the deframer's corrupted span (relative to start) instead of starting
+    #   fresh. The span still open at the end is left relative to the trailing partial frame either way
+    def decode(self, buffer, start=0, end=None, resume=False):
+        n = len(buffer) if end is None else end
+        view = memoryview(buffer)
+        decodeFrame = self.protocol.decodeFrame
+        deframer = self.deframer
+        if resume:
+            deframer.carry.clear()
+            deframer.salvageEnd += start if deframer.salvageEnd > 0 else 0
+        else:
+            deframer.reset()
+
+        stats = self.protocol.getStats()
+        frames = []
+
+        if np is None:
+            self.decodeSpans(deframer.spans(buffer, start, n, 0, n), view, frames)
+            deframer.moveSalvage(deframer.pos)
+            return (frames, deframer.pos)
+
+        pos = start
+        size = SPAN_WINDOW
+
+        # the rest of a corrupted span carried over is scanned frame by frame first
+        if deframer.salvageEnd > pos:
+            pos, partial = self.scan(buffer, pos, min(deframer.salvageEnd, n), n, view, frames)
+            if partial:
+                deframer.moveSalvage(pos)
+                return (frames, pos)
+
+        while pos < n:
+            window = min(pos + size, n)
+            offsets, lengths, stop = frameSpans(buffer, pos, window)
+            bad = np.flatnonzero(~validMask(buffer, offsets, lengths))
+
+            # i is the next frame of the window to take, k the next bad one
+            i = 0
+            k = 0
+            while True:
+                # plain ints -- the stats go out as json
+                b = int(bad[k]) if k < len(bad) else len(offsets)
+                for o, l in zip(offsets[i:b], lengths[i:b]):
+                    frames.append(decodeFrame(view[o:o + l]))
+                stats['frameCount'] += b - i
+
+                if b == len(offsets):
+                    pos = stop
+                    size = min(size * 2, SPAN_WINDOW)
+                    break
+
+                # resync inside the bad frame like StreamDeframer
+                pos, partial = self.scan(buffer, offsets[b], offsets[b] + lengths[b], n, view, frames)
+                if partial:
+                    deframer.moveSalvage(pos)
+                    return (frames, pos)
+
+                # usually that comes out on the next frame of the window, else spans start over from it
+                i = bisect_left(offsets, pos)
+                if i == len(offsets) or offsets[i] != pos:
+                    # noisy -- a stretch frame by frame, then smaller windows until it is clean again
+                    pos, partial = self.scan(buffer, pos, min(pos + MIN_SPAN_WINDOW, n), n, view, frames)
+                    if partial:
+                        deframer.moveSalvage(pos)
+                        return (frames, pos)
+
+                    size = MIN_SPAN_WINDOW
+                    break
+                k = int(np.searchsorted(bad, i))
+
+            if pos == stop and window == n:
+                # the last frame may run past the end, or not be one -- StreamDeframer decides
+                self.decodeSpans(deframer.spans(buffer, stop, n, 0, n), view, frames)
+                pos = deframer.pos
+                break
+
+        # as StreamDeframer leaves it: a corrupted span that ended is counted, one still open carries on
+        deframer.moveSalvage(pos)
+        return (frames, pos)
+
+    # decodes frame by frame like StreamDeframer, from pos until past limit and any corrupted span
+    # found on the way -- (where it stopped, True if that was on a partial frame at the end)
+    def scan(self, buffer, pos, limit, n, view, frames):
+        while True:
+            self.decodeSpans(self.deframer.spans(buffer, pos, limit, 0, n), view, frames)
+            pos = self.deframer.pos
+            if pos < limit:
+                return (pos, True)
+            if pos >= min(self.deframer.salvageEnd, n):
+                return (pos, False)
+            limit = min(self.deframer.salvageEnd, n)
+
+    def decodeSpans(self, spans, view, frames):
+        for s, e in spans:
+            frames.append(self.protocol.decodeFrame(view[s:e]))
+        self.protocol.getStats()['frameCount'] += len(spans)
@@ -0,0 +1,138 @@
+# BusReader
+#
+#   Wraps another connection (e.g. SerialConnection) with a dedicated thread that does nothing but drain
+#   it, cut what it reads into frames (StreamDeframer) and queue the completed frames in a bounded,
+#   preallocated ring buffer.  listen() then hands over the frames that have arrived, back to back, so
+#   the processing/publishing thread can block on the network as long as it likes without the UART
+#   overflowing -- and never sees part of a frame.  If the ring does fill up, the newest frames are
+#   dropped whole and counted.  The frames are checked already: split them with FrameSplitter (or a
+#   FusedPipeline with exact=True) rather than deframing them again.
+#
+#   Line noise stays behind in the reader: the corrupted spans it found are in takeStats() (badFrames,
+#   salvagedFrames, lostFrames and frameCount, to add to the protocol's), and a capture or flight
+#   recorder downstream only sees the completed frames.
+#
+
+import threading
+
+from Connection import IOConnection
+from PentairStream import StreamDeframer
+
+
+# fixed-size FIFO of bytes, safe for one writer thread and one reader thread -- each write goes in whole
+# or not at all
+class ByteRing:
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.lock = threading.Lock()
+
+        self.head = 0       # total bytes ever written
+        self.tail = 0       # total bytes ever read
+        self.dropped = 0
+        self.overflows = 0
+
+    # returns the bytes written -- 0 if data did not fit
+    def write(self, data):
+        size = len(self.buffer)
+        n = len(data)
+
+        with self.lock:
+            if n > size - (self.head - self.tail):
+                self.dropped += n
+                self.overflows += 1
+                return 0
+
+            pos = self.head % size
+            if pos + n <= size:
+                self.buffer[pos:pos + n] = data
+            else:
+                first = size - pos
+                view = memoryview(data)
+                self.buffer[pos:] = view[:first]
+                self.buffer[:n - first] = view[first:]
+
+            self.head += n
+
+        return n
+
+    # everything written since the last read
+    def read(self):
+        size = len(self.buffer)
+
+        with self.lock:
+            a = self.tail % size
+            b = a + self.head - self.tail
+            self.tail = self.head
+
+            if b <= size:
+                return bytes(self.buffer[a:b])
+
+            return bytes(self.buffer[a:]) + bytes(self.buffer[:b - size])
+
+    # returns and clears the overflow counters
+    def takeStats(self):
+        with self.lock:
+            stats = { 'overflowBytes': self.dropped, 'overflows': self.overflows }
+            self.dropped = 0
+            self.overflows = 0
+
+        return stats
+
+
+class BusReader(IOConnection):
+    def __init__(self, connection, capacity=65536, pollInterval=0.01):
+        super().__init__()
+        self.connection = connection
+        self.ring = ByteRing(capacity)
+        self.pollInterval = pollInterval
+
+        # the reader thread's own -- its protocol only keeps the stats of the corrupted spans
+        self.deframer = StreamDeframer()
+        self.deframerLock = threading.Lock()
+
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def isOpen(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def open(self):
+        if not self.connection.isOpen():
+            self.connection.open()
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='BusReader', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            data = self.connection.listen()
+            if len(data) > 0:
+                with self.deframerLock:
+                    for f in self.deframer.frames(data):
+                        self.ring.write(f)
+            else:
+                self.stopping.wait(self.pollInterval)
+
+    def listen(self):
+        self.readbuffer = self.ring.read()
+        return self.readbuffer
+
+    def send(self, message):
+        return self.connection.send(message)
+
+    def takeStats(self):
+        stats = self.ring.takeStats()
+
+        with self.deframerLock:
+            protocol = self.deframer.protocol
+            for k in ('frameCount', 'badFrames', 'salvagedFrames', 'lostFrames'):
+                stats[k] = protocol.getStats()[k]
+            protocol.resetStats()
+
+        return stats
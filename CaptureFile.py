@@ -0,0 +1,222 @@
+# CaptureFile
+#
+#   An append-only, timestamped capture of the raw stream, with a sparse time index next to it.
+#
+#   data file -- header, then one record per chunk read from the connection:
+#       MAGIC           8 bytes
+#       startTime       8 bytes, little endian double -- wall clock (epoch seconds) when recording began
+#       records:
+#           time        8 bytes, little endian double -- monotonic seconds since recording began
+#           length      4 bytes, little endian
+#           data        length bytes, exactly as read
+#
+#   index file (data file name + '.idx') -- a (time, offset) entry for the first record written at
+#   least indexInterval seconds after the previous entry:
+#       INDEX_MAGIC     8 bytes
+#       entries:
+#           time        8 bytes, little endian double
+#           offset      8 bytes, little endian -- of the record in the data file
+#
+#   CaptureReader bisects the index to jump near a time, then walks forward record by record. Without
+#   the index it walks from the first record.
+#
+
+from array import array
+from bisect import bisect_right
+import mmap
+import os
+import struct
+import time
+
+from Observer import Observer
+
+
+MAGIC = b'PNTRCAP1'
+INDEX_MAGIC = b'PNTRIDX1'
+INDEX_SUFFIX = '.idx'
+
+HEADER = struct.Struct('<8sd')
+RECORD = struct.Struct('<dI')
+INDEX_ENTRY = struct.Struct('<dQ')
+
+
+def isCapture(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except Exception as err:
+        return False
+
+
+# observes the raw stream (e.g. streamData) and appends every chunk to the capture
+#   startTime overrides the wall clock written to the header (e.g. when writing out older data)
+#
+#   An existing capture is carried on, not overwritten -- its header and index are checked, a torn
+#   last record or index entry (crash while recording) is cut off, and the new records keep the
+#   time base (and startTime) of its header.
+class CaptureRecorder(Observer):
+    def __init__(self, filename, indexInterval=1.0, startTime=None):
+        super().__init__()
+        self.filename = filename
+        self.indexInterval = indexInterval
+        self.lastIndexTime = None
+        self.lastTime = 0.0
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.resume()
+            return
+
+        self.file = open(filename, 'wb')
+        self.indexFile = open(filename + INDEX_SUFFIX, 'wb')
+
+        self.startTime = time.time() if startTime is None else startTime
+        self.monoStart = time.monotonic()
+
+        self.file.write(HEADER.pack(MAGIC, self.startTime))
+        self.indexFile.write(INDEX_MAGIC)
+
+    def resume(self):
+        # raises ValueError if the file is not a capture -- better than losing it
+        reader = CaptureReader(self.filename)
+        try:
+            # walk from the last index entry the data still covers to the last whole record
+            i = bisect_right(reader.offsets, len(reader.map) - RECORD.size)
+            reader.offset = reader.offsets[i - 1] if i > 0 else HEADER.size
+
+            record = reader.peek()
+            while record is not None:
+                self.lastTime = max(self.lastTime, record[0])
+                reader.advance()
+                record = reader.peek()
+
+            end = reader.offset
+            kept = bisect_right(reader.offsets, end - 1)
+            if kept > 0:
+                self.lastIndexTime = reader.times[kept - 1]
+            self.startTime = reader.startTime
+            indexed = reader.indexed
+        finally:
+            reader.close()
+
+        self.file = open(self.filename, 'r+b')
+        self.file.truncate(end)
+        self.file.seek(end)
+
+        # without a good index a new one starts here -- reads before its first entry walk from the
+        # first record
+        if indexed:
+            self.indexFile = open(self.filename + INDEX_SUFFIX, 'r+b')
+            self.indexFile.truncate(len(INDEX_MAGIC) + kept * INDEX_ENTRY.size)
+            self.indexFile.seek(0, os.SEEK_END)
+        else:
+            self.indexFile = open(self.filename + INDEX_SUFFIX, 'wb')
+            self.indexFile.write(INDEX_MAGIC)
+
+        # times carry on from the header's startTime
+        self.monoStart = time.monotonic() - (time.time() - self.startTime)
+
+    def update(self, chunk):
+        self.record(chunk)
+
+    def record(self, chunk, t=None):
+        if t is None:
+            # never before the records already there (the wall clock may have been set back since)
+            t = max(time.monotonic() - self.monoStart, self.lastTime)
+
+        if self.lastIndexTime is None or t - self.lastIndexTime >= self.indexInterval:
+            self.indexFile.write(INDEX_ENTRY.pack(t, self.file.tell()))
+            self.lastIndexTime = t
+            # flush with the index so a crash loses at most one interval
+            self.flush()
+
+        self.file.write(RECORD.pack(t, len(chunk)))
+        self.file.write(chunk)
+
+    def flush(self):
+        self.file.flush()
+        self.indexFile.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.indexFile.close()
+
+
+# walks the records of a capture through a read-only map of the file
+class CaptureReader:
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.map) < HEADER.size:
+            raise ValueError(f'{filename} is not a capture file')
+
+        magic, self.startTime = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a capture file')
+
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.indexed = self.loadIndex()
+
+        self.offset = HEADER.size
+
+    # True if there is an index
+    def loadIndex(self):
+        try:
+            with open(self.filename + INDEX_SUFFIX, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return False
+
+                entries = f.read()
+        except Exception as err:
+            return False
+
+        # a torn last entry (crash while recording) is ignored
+        for t, offset in INDEX_ENTRY.iter_unpack(entries[:len(entries) - len(entries) % INDEX_ENTRY.size]):
+            self.times.append(t)
+            self.offsets.append(offset)
+
+        return True
+
+    # position on the first record at or after t (seconds since recording began)
+    def seek(self, t):
+        i = bisect_right(self.times, t) - 1
+        self.offset = self.offsets[i] if i >= 0 else HEADER.size
+
+        record = self.peek()
+        while record is not None and record[0] < t:
+            self.advance()
+            record = self.peek()
+
+    # (time, start, end) of the data in the current record -- None at the end of the capture
+    def peek(self):
+        if self.offset + RECORD.size > len(self.map):
+            return None
+
+        t, length = RECORD.unpack_from(self.map, self.offset)
+        start = self.offset + RECORD.size
+        if start + length > len(self.map):
+            return None
+
+        return (t, start, start + length)
+
+    def advance(self):
+        t, length = RECORD.unpack_from(self.map, self.offset)
+        self.offset += RECORD.size + length
+
+    def records(self, start=0, end=None):
+        self.seek(start)
+
+        record = self.peek()
+        while record is not None and (end is None or record[0] <= end):
+            yield (record[0], self.map[record[1]:record[2]])
+
+            self.advance()
+            record = self.peek()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,255 @@
+# EasyTouchSimulator
+#
+#   Plays an EasyTouch controller (address 0x10) and a pump (0x60) on a bus -- normally one end of a
+#   pseudo-terminal, so pentair-control.py can be pointed at the other end with --port.
+#
+#   Broadcasts status (24/02), date (24/05), temperature (24/08) and pump (00/07) frames on a schedule,
+#   with slowly wandering temperatures and pump load.  Circuit (24/86) and heat (24/88) commands are
+#   ACK'd (24/01) and change the state reported by the following frames.  Noise can be injected at a
+#   given probability per frame, as idle-line garbage or a flipped byte.
+#
+
+import os
+import random
+import select
+import struct
+import time
+import tty
+
+from PentairProtocol import PentairProtocol
+from PentairStream import StreamDeframer
+
+
+class EasyTouchSimulator:
+    CONTROLLER = 0x10
+    PUMP = 0x60
+    BROADCAST = 0x0F
+
+    # CircuitChangeCommand selector -> (status byte, bit)
+    CIRCUIT_BITS = {    0x01: (2, 0x01),    # spa
+                        0x02: (2, 0x02),    # aux1
+                        0x03: (2, 0x04),    # aux2
+                        0x04: (2, 0x08),    # aux3
+                        0x05: (2, 0x10),    # feature1
+                        0x06: (2, 0x20),    # pool
+                        0x07: (2, 0x40),    # feature2
+                        0x08: (2, 0x80),    # feature3
+                        0x09: (3, 0x01) }   # feature4
+
+    # seconds between broadcasts of each message, at rate 1
+    PERIODS = { 'status': 2.0,
+                'date': 2.0,
+                'temp': 10.0,
+                'pump': 5.0 }
+
+    # started, mode, state, watts, rpm, 5 unknown -- then 3 more (sequence number?) for the real 15 bytes
+    PUMP_PAYLOAD = struct.Struct('>BBBHH5x')
+
+    def __init__(self, rate=1.0, noise=0.0, seed=None):
+        self.protocol = PentairProtocol()
+        self.deframer = StreamDeframer()
+        self.random = random.Random(seed)
+
+        self.rate = rate
+        self.noise = noise
+
+        self.circuits = bytearray(2)
+        self.circuits[0] = 0x20         # pool on
+        self.waterTemp = 82
+        self.spaTemp = 82
+        self.airTemp = 75
+        self.poolSetTemp = 85
+        self.spaSetTemp = 100
+        self.poolHeaterMode = 0
+        self.spaHeaterMode = 0
+        self.pumpWatts = 785
+        self.pumpRPM = 2400
+
+        self.stats = {  'framesSent': 0,
+                        'noiseInjected': 0,
+                        'commandsAcked': 0 }
+
+        self.due = {}
+
+    #
+    # payloads -- laid out to match what the Payload classes decode
+    #
+    def circuitOn(self, selector):
+        byte, bit = self.CIRCUIT_BITS[selector]
+        return (self.circuits[byte - 2] & bit) != 0
+
+    def pumpRunning(self):
+        return self.circuitOn(0x01) or self.circuitOn(0x06)
+
+    def heaterOn(self):
+        if self.circuitOn(0x01):
+            return self.spaHeaterMode != 0 and self.spaTemp < self.spaSetTemp
+        if self.circuitOn(0x06):
+            return self.poolHeaterMode != 0 and self.waterTemp < self.poolSetTemp
+        return False
+
+    def statusPayload(self, now):
+        body = bytearray(29)
+        body[0] = now.tm_hour
+        body[1] = now.tm_min
+        body[2] = self.circuits[0]
+        body[3] = self.circuits[1]
+        body[9] = 0x20
+        body[10] = 0x0C if self.heaterOn() else 0x00
+        body[12] = 0x20
+        body[13] = 0x86
+        body[14] = self.waterTemp
+        body[15] = self.spaTemp
+        body[18] = self.airTemp
+        body[22] = (self.spaHeaterMode << 2) | self.poolHeaterMode
+        body[25:29] = b'\xCB\xA5\x00\x0D'
+        return bytes(body)
+
+    def datePayload(self, now):
+        # tm_wday is Monday == 0, the controller sends Sunday == 0x01 ... Saturday == 0x40
+        dow = 0x01 << ((now.tm_wday + 1) % 7)
+        return bytes([now.tm_hour, now.tm_min, dow, now.tm_mday, now.tm_mon, now.tm_year % 100, 0, 1])
+
+    def tempPayload(self):
+        return bytes([self.waterTemp, self.spaTemp, self.airTemp, self.poolSetTemp, self.spaSetTemp]) + bytes(8)
+
+    def pumpPayload(self):
+        if not self.pumpRunning():
+            return self.PUMP_PAYLOAD.pack(0x04, 0x00, 0x00, 0, 0) + b'\x01\x13\x3B'
+        return self.PUMP_PAYLOAD.pack(0x0A, 0x02, 0x02, self.pumpWatts, self.pumpRPM) + b'\x01\x13\x3B'
+
+    def frame(self, commandType, dst, src, command, payload):
+        return self.protocol.createFrame({  'type': commandType,
+                                            'destination': dst,
+                                            'source': src,
+                                            'command': command,
+                                            'payloadLength': len(payload),
+                                            'payload': payload })
+
+    def statusFrame(self, now=None):
+        return self.frame(0x24, self.BROADCAST, self.CONTROLLER, 0x02, self.statusPayload(now or time.localtime()))
+
+    def dateFrame(self, now=None):
+        return self.frame(0x24, self.BROADCAST, self.CONTROLLER, 0x05, self.datePayload(now or time.localtime()))
+
+    def tempFrame(self):
+        return self.frame(0x24, self.BROADCAST, self.CONTROLLER, 0x08, self.tempPayload())
+
+    def pumpFrame(self):
+        return self.frame(0x00, self.CONTROLLER, self.PUMP, 0x07, self.pumpPayload())
+
+    def ackFrame(self, dst, command):
+        return self.frame(0x24, dst, self.CONTROLLER, PentairProtocol.ACK, bytes([command]))
+
+    #
+    # state changes
+    #
+    def wander(self):
+        r = self.random.random()
+        if r < 0.1:
+            self.waterTemp += self.random.choice((-1, 1))
+        elif r < 0.2:
+            self.airTemp += self.random.choice((-1, 1))
+
+        if self.pumpRunning():
+            self.pumpWatts = max(0, self.pumpWatts + self.random.randint(-3, 3))
+            self.pumpRPM = max(0, self.pumpRPM + self.random.choice((-1, 0, 1)))
+
+    def handleCommand(self, frame):
+        if frame is None or frame.type != 0x24 or frame.destination != self.CONTROLLER:
+            return None
+
+        payload = frame.payload
+        if frame.command == 0x86 and len(payload) >= 2:
+            if payload[0] not in self.CIRCUIT_BITS:
+                return None
+
+            byte, bit = self.CIRCUIT_BITS[payload[0]]
+            if payload[1]:
+                self.circuits[byte - 2] |= bit
+            else:
+                self.circuits[byte - 2] &= ~bit
+
+        elif frame.command == 0x88 and len(payload) >= 3:
+            self.poolSetTemp = payload[0]
+            self.spaSetTemp = payload[1]
+            self.poolHeaterMode = payload[2] & 0x03
+            self.spaHeaterMode = (payload[2] & 0x0C) >> 2
+
+        else:
+            return None
+
+        self.stats['commandsAcked'] += 1
+        return self.ackFrame(frame.source, frame.command)
+
+    # parses whatever was written to the bus and returns the replies
+    def receive(self, data):
+        replies = []
+        for f in self.deframer.deframe(data):
+            reply = self.handleCommand(self.protocol.parseFrame(f, padded=False))
+            if reply is not None:
+                replies.append(reply)
+
+        return replies
+
+    #
+    # broadcast schedule
+    #
+    def inject(self, frame):
+        if self.noise <= 0 or self.random.random() >= self.noise:
+            return frame
+
+        self.stats['noiseInjected'] += 1
+        if self.random.random() < 0.5:
+            # garbage on the idle line, often looking like the start of a frame
+            garbage = bytes(self.random.randrange(256) for i in range(self.random.randint(1, 12)))
+            return garbage + b'\xA5' + frame
+        else:
+            corrupted = bytearray(frame)
+            corrupted[self.random.randrange(len(corrupted))] ^= 1 << self.random.randrange(8)
+            return bytes(corrupted)
+
+    def dueFrames(self, now):
+        frames = []
+        for name, period in self.PERIODS.items():
+            if now >= self.due.get(name, 0):
+                self.due[name] = now + period / self.rate
+                frames.append(getattr(self, name + 'Frame')())
+
+        if len(frames) > 0:
+            self.wander()
+            self.stats['framesSent'] += len(frames)
+
+        return [self.inject(f) for f in frames]
+
+    def nextDue(self):
+        return min(self.due.values()) if len(self.due) > 0 else 0
+
+    # plays the bus on fd until duration seconds have passed (forever if None)
+    def run(self, fd, duration=None):
+        start = time.monotonic()
+        while duration is None or time.monotonic() - start < duration:
+            now = time.monotonic()
+            for f in self.dueFrames(now):
+                os.write(fd, f)
+
+            wait = max(0, self.nextDue() - time.monotonic())
+            readable, w, x = select.select([fd], [], [], wait)
+            if len(readable) > 0:
+                try:
+                    data = os.read(fd, 4096)
+                except OSError as err:
+                    # no one has the other end open yet
+                    time.sleep(wait)
+                    continue
+
+                for reply in self.receive(data):
+                    os.write(fd, reply)
+
+
+# opens a pseudo-terminal pair -- returns (master fd, slave fd, slave device name)
+def openPty():
+    master, slave = os.openpty()
+    # no echo or line editing until someone opens and configures the port
+    tty.setraw(slave)
+    return (master, slave, os.ttyname(slave))
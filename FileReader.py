@@ -1,17 +1,49 @@
 # FileReader
 #   Really just a mock for some basic testing without the Serial port or a way to replay key bits
 #
-#   no size limiting, no chunking, very simple
+#   By default there is no size limiting and no chunking -- the whole file comes back from the first
+#   listen().  Set chunkSize to mmap the file instead and return at most chunkSize bytes per listen(),
+#   cut at a RECORD_SEPARATOR so frames are not split between chunks.  Memory use then stays flat no
+#   matter how big the capture is.
+#
+#   Set speed to pace the replay like the bus would deliver it: 1 is real time at 9600 baud, 2 is twice
+#   that, and so on.  A paced listen() returns only the bytes that would have arrived since the first
+#   listen() -- still capped at chunkSize if one is set -- with no alignment, just like the serial port.
+#   speed 0 replays as fast as possible.
+#
+#   Timestamped captures (see CaptureFile) are detected on open.  Only records between start and end
+#   (seconds since recording began) are replayed, found through the capture's index, and pacing follows
+#   the recorded timestamps instead of the baud rate.
 #
 
+import mmap
+import time
+
+from CaptureFile import CaptureReader, isCapture
 from Connection import Connection
+from PentairProtocol import PentairProtocol
 
 
 class FileReader(Connection):
-    def __init__(self, filename):
+    # 8N1 framing puts 10 bits on the wire for every byte
+    BAUD_RATE = 9600
+    BYTES_PER_SECOND = BAUD_RATE / 10
+
+    def __init__(self, filename, chunkSize=0, speed=0, start=0, end=None):
         super().__init__()
         self.filename = filename
         self.file = None
+        self.capture = None
+
+        self.start = start
+        self.end = end
+
+        self.chunkSize = chunkSize
+        self.map = None
+        self.offset = 0
+
+        self.speed = speed
+        self.startTime = None
 
         # self.open()
 
@@ -20,14 +52,94 @@ class FileReader(Connection):
 
     def open(self):
         try:
+            if isCapture(self.filename):
+                self.capture = CaptureReader(self.filename)
+                self.capture.seek(self.start)
+                self.file = self.capture.file
+                self.startTime = None
+                return
+
             self.file = open(self.filename, 'rb')
+
+            if self.chunkSize > 0 or self.speed > 0:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self.map, 'madvise'):
+                    self.map.madvise(mmap.MADV_SEQUENTIAL)
+                self.offset = 0
+                self.startTime = None
         except Exception as err:
             print(f'error opening {self.filename}: {err}')
 
     def listen(self):
+        if self.capture is not None:
+            return self.readRecords()
+
+        if self.chunkSize > 0 or self.speed > 0:
+            return self.readChunk()
+
         try:
-            self.readbuffer = self.file.read() 
+            self.readbuffer = self.file.read()
         except Exception as e:
             print("Exception " + e + " while reading from file")
 
         return self.readbuffer
+
+    # next chunk from the map -- empty once the end of the file is reached
+    def readChunk(self):
+        self.readbuffer = b''
+        if self.map is None:
+            return self.readbuffer
+
+        start = self.offset
+        limit = len(self.map)
+
+        if self.speed > 0:
+            if self.startTime is None:
+                self.startTime = time.monotonic()
+
+            arrived = int((time.monotonic() - self.startTime) * self.BYTES_PER_SECOND * self.speed)
+            limit = min(limit, arrived)
+
+        end = limit if self.chunkSize == 0 else min(start + self.chunkSize, limit)
+
+        # end the chunk just before the last separator so the next one starts on a frame boundary
+        if self.speed == 0 and end < limit:
+            cut = self.map.rfind(PentairProtocol.RECORD_SEPARATOR, start + 1, end)
+            if cut > start:
+                end = cut
+
+        self.readbuffer = self.map[start:end]
+        self.offset = end
+
+        return self.readbuffer
+
+    # the next records from a capture -- whole records, up to chunkSize bytes (but at least one record)
+    def readRecords(self):
+        due = None
+        if self.speed > 0:
+            if self.startTime is None:
+                self.startTime = time.monotonic()
+
+            due = self.start + (time.monotonic() - self.startTime) * self.speed
+
+        chunks = []
+        size = 0
+        record = self.capture.peek()
+        while record is not None:
+            t, start, end = record
+            if self.end is not None and t > self.end:
+                break
+            if due is not None and t > due:
+                break
+            if self.chunkSize > 0 and size > 0 and size + end - start > self.chunkSize:
+                break
+
+            chunks.append(self.capture.map[start:end])
+            size += end - start
+
+            self.capture.advance()
+            record = self.capture.peek()
+
+        self.readbuffer = b''.join(chunks)
+
+        return self.readbuffer
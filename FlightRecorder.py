@@ -0,0 +1,125 @@
+# FlightRecorder
+#
+#   Keeps the last few seconds (or bytes) of the raw stream in fixed memory, and writes them out as a
+#   capture (see CaptureFile) when a protocol stat crosses its trigger -- e.g. a burst of badFrames or
+#   a command that was never ACK'd.
+#
+#   The byte ring and the per-read markers are allocated up front; update() only copies into them.
+#
+
+from array import array
+from datetime import datetime
+import time
+
+from CaptureFile import CaptureRecorder
+from Observer import Observer
+
+
+class FlightRecorder(Observer):
+    # stat -> count in one check (i.e. one tick of stats) that dumps the recorder
+    TRIGGERS = {    'badFrames': 5,
+                    'unackedCommands': 1 }
+
+    def __init__(self, seconds=60, maxBytes=65536, maxReads=4096, triggers=None, prefix='flight', holdoff=None):
+        super().__init__()
+        self.seconds = seconds
+        self.prefix = prefix
+        self.triggers = dict(self.TRIGGERS if triggers is None else triggers)
+
+        # by default, don't dump again until the window has been refilled
+        self.holdoff = seconds if holdoff is None else holdoff
+        self.lastDump = None
+
+        # ring of raw bytes -- position in the ring is the running total % size
+        self.buffer = bytearray(maxBytes)
+        self.total = 0
+
+        # ring of reads -- when each arrived and where it sits in the running total
+        self.times = array('d', bytes(8 * maxReads))
+        self.starts = array('Q', bytes(8 * maxReads))
+        self.ends = array('Q', bytes(8 * maxReads))
+        self.count = 0
+
+    def update(self, chunk):
+        self.write(chunk)
+
+    def write(self, chunk):
+        n = len(chunk)
+        size = len(self.buffer)
+
+        if n > size:
+            # only the newest bytes fit
+            chunk = memoryview(chunk)[n - size:]
+            self.total += n - size
+            n = size
+
+        start = self.total
+        pos = self.total % size
+        if pos + n <= size:
+            self.buffer[pos:pos + n] = chunk
+        else:
+            first = size - pos
+            view = memoryview(chunk)
+            self.buffer[pos:] = view[:first]
+            self.buffer[:n - first] = view[first:]
+
+        self.total += n
+
+        i = self.count % len(self.times)
+        self.times[i] = time.monotonic()
+        self.starts[i] = start
+        self.ends[i] = self.total
+        self.count += 1
+
+    # call with the protocol stats before they are reset -- returns the dump file name if one was written
+    def check(self, stats):
+        for k, threshold in self.triggers.items():
+            if stats.get(k, 0) >= threshold:
+                return self.trigger(k)
+
+        return None
+
+    def trigger(self, reason):
+        now = time.monotonic()
+        if self.lastDump is not None and now - self.lastDump < self.holdoff:
+            return None
+
+        self.lastDump = now
+        return self.dump(reason)
+
+    def dump(self, reason='manual'):
+        now = time.monotonic()
+        oldestByte = self.total - len(self.buffer)
+        oldestRead = max(0, self.count - len(self.times))
+
+        # walk back from the newest read while it is inside the window and still in the ring
+        first = self.count
+        while first > oldestRead:
+            i = (first - 1) % len(self.times)
+            if self.times[i] < now - self.seconds or self.ends[i] <= oldestByte:
+                break
+
+            first -= 1
+            if self.starts[i] < oldestByte:
+                # only the newest part of this read is left
+                break
+
+        t0 = self.times[first % len(self.times)] if first < self.count else now
+        filename = f'{self.prefix}-{datetime.now():%Y%m%d-%H%M%S}-{reason}.cap'
+
+        recorder = CaptureRecorder(filename, startTime=time.time() - (now - t0))
+        for r in range(first, self.count):
+            i = r % len(self.times)
+            recorder.record(self.read(max(self.starts[i], oldestByte), self.ends[i]), self.times[i] - t0)
+        recorder.close()
+
+        return filename
+
+    def read(self, start, end):
+        size = len(self.buffer)
+        a = start % size
+        b = a + end - start
+        if b <= size:
+            return bytes(self.buffer[a:b])
+
+        return bytes(self.buffer[a:]) + bytes(self.buffer[:b - size])
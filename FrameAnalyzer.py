@@ -0,0 +1,201 @@
+# FrameAnalyzer
+#
+#   Helps decode new messages.  Observes frames, and for every frame no decoder knows about keeps
+#   statistics per byte position of its payload -- grouped by (type, source, destination, command,
+#   length) -- in fixed-size NumPy arrays:
+#
+#       histogram       count of each value 0 - 255
+#       changes         how often the byte differs from the same byte of the group's previous frame
+#       increments      ... and how often it is exactly one more (mod 256), i.e. a counter
+#       bit flips       how often each bit differs from the previous frame
+#       correlation     running sums for the Pearson correlation with every known (numeric) state key,
+#                       taken from the decoded frames seen so far
+#
+#   Payloads are collected into a preallocated batch per group and folded into the statistics a batch
+#   at a time, so memory stays flat however long the capture is.  report() classifies each byte as
+#   constant, counter, correlated with a state key, or just varying.
+#
+#   Needs numpy.
+#
+
+import math
+
+import numpy as np
+
+from Observer import Observer
+from PentairProtocol import PAYLOADS
+
+
+class ByteStats:
+    def __init__(self, length, keyCount, batch):
+        self.length = length
+        self.count = 0
+
+        self.histogram = np.zeros((length, 256), dtype=np.int64)
+        self.changes = np.zeros(length, dtype=np.int64)
+        self.increments = np.zeros(length, dtype=np.int64)
+        self.flips = np.zeros((length, 8), dtype=np.int64)
+        self.last = None
+
+        # correlation sums -- per byte and key over the frames where the key was known, x the byte and y the key
+        self.sx = np.zeros((length, keyCount))
+        self.sxx = np.zeros((length, keyCount))
+        self.sxy = np.zeros((length, keyCount))
+        self.sy = np.zeros(keyCount)
+        self.syy = np.zeros(keyCount)
+        self.n = np.zeros(keyCount)
+
+        self.rows = np.zeros((batch, length), dtype=np.uint8)
+        self.states = np.zeros((batch, keyCount))
+        self.fill = 0
+
+    def add(self, payload, state):
+        self.rows[self.fill] = np.frombuffer(payload, dtype=np.uint8)
+        self.states[self.fill] = state
+        self.fill += 1
+
+        if self.fill == len(self.rows):
+            self.flush()
+
+    def flush(self):
+        if self.fill == 0:
+            return
+
+        x = self.rows[:self.fill]
+        y = self.states[:self.fill]
+
+        positions = np.arange(self.length) * 256
+        self.histogram += np.bincount((positions + x).ravel(), minlength=self.length * 256).reshape(self.length, 256)
+
+        # transitions, including the one from the last frame of the previous batch
+        sequence = x if self.last is None else np.vstack((self.last, x))
+        previous = sequence[:-1]
+        current = sequence[1:]
+        diff = previous ^ current
+        self.changes += (diff != 0).sum(axis=0)
+        self.increments += (current == previous + np.uint8(1)).sum(axis=0)
+        self.flips += np.unpackbits(diff[:, :, np.newaxis], axis=2, bitorder='little').sum(axis=0, dtype=np.int64)
+        self.last = x[-1].copy()
+
+        known = ~np.isnan(y)
+        m = known.astype(np.float64)
+        y = np.where(known, y, 0.0)
+        xf = x.astype(np.float64)
+        self.sx += xf.T @ m
+        self.sxx += (xf * xf).T @ m
+        self.sxy += xf.T @ y
+        self.sy += y.sum(axis=0)
+        self.syy += (y * y).sum(axis=0)
+        self.n += m.sum(axis=0)
+
+        self.count += self.fill
+        self.fill = 0
+
+    # (length, keys) Pearson correlation of each byte with each key -- nan where either doesn't vary
+    def correlation(self):
+        n = self.n
+        cov = n * self.sxy - self.sx * self.sy
+        varX = n * self.sxx - self.sx * self.sx
+        varY = n * self.syy - self.sy * self.sy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = cov / np.sqrt(varX * varY)
+
+        r[(varX <= 0) | (varY <= 0)] = np.nan
+        return r
+
+
+class FrameAnalyzer(Observer):
+    def __init__(self, protocol, batch=4096, includeKnown=False):
+        super().__init__()
+        self.protocol = protocol
+        self.batch = batch
+        self.includeKnown = includeKnown
+
+        # the numeric state keys to correlate against -- also the keys asked of the protocol
+        self.keys = tuple(sorted(k for k in PAYLOADS.allKeys() if k != 'dow'))
+        self.index = { k: i for i, k in enumerate(self.keys) }
+        self.current = np.full(len(self.keys), np.nan)
+
+        # (type, source, destination, command, length) -> ByteStats
+        self.groups = {}
+
+    def update(self, frames):
+        for f in frames:
+            known = (f.type, f.command) in self.protocol.decoders
+            if known:
+                for k, v in f.state.items():
+                    i = self.index.get(k)
+                    if i is not None:
+                        self.current[i] = v
+
+            if not known or self.includeKnown:
+                group = (f.type, f.source, f.destination, f.command, len(f.payload))
+                stats = self.groups.get(group)
+                if stats is None:
+                    stats = self.groups[group] = ByteStats(len(f.payload), len(self.keys), self.batch)
+
+                if len(f.payload) > 0:
+                    stats.add(f.payload, self.current)
+                else:
+                    stats.count += 1
+
+    def flush(self):
+        for stats in self.groups.values():
+            stats.flush()
+
+    #
+    # report
+    #
+    def report(self, minFrames=2, threshold=0.9):
+        self.flush()
+
+        lines = []
+        groups = sorted(self.groups.items(), key=lambda g: -g[1].count)
+        for (t, src, dst, cmd, length), stats in groups:
+            if stats.count < minFrames:
+                continue
+
+            lines.append(f'type {t:02X}  src {src:02X}  dst {dst:02X}  cmd {cmd:02X}  length {length}:  {stats.count} frames')
+            lines.extend(self.describe(stats, threshold))
+            lines.append('')
+
+        return '\n'.join(lines)
+
+    def describe(self, stats, threshold):
+        lines = []
+        transitions = max(1, stats.count - 1)
+        r = stats.correlation()
+
+        i = 0
+        while i < stats.length:
+            values = np.flatnonzero(stats.histogram[i])
+
+            if len(values) == 1:
+                # runs of constant bytes on one line
+                j = i
+                while j + 1 < stats.length and np.count_nonzero(stats.histogram[j + 1]) == 1:
+                    j += 1
+                constants = ' '.join(f'{np.flatnonzero(stats.histogram[k])[0]:02X}' for k in range(i, j + 1))
+                position = f'{i}' if i == j else f'{i}-{j}'
+                lines.append(f'  [{position:>5}]  constant  {constants}')
+                i = j + 1
+                continue
+
+            line = f'  [{i:>5}]  {values[0]:02X}..{values[-1]:02X}  {len(values):3} values  ' \
+                   f'changes {stats.changes[i] / transitions:4.0%}'
+
+            if stats.increments[i] >= 0.9 * transitions:
+                line += '  counter'
+            else:
+                flips = stats.flips[i] / transitions
+                line += '  bits ' + ' '.join(f'{b}:{flips[b]:.0%}' for b in np.argsort(-flips)[:3] if flips[b] > 0)
+
+            correlated = [(abs(r[i, k]), k) for k in range(len(self.keys))
+                            if not math.isnan(r[i, k]) and abs(r[i, k]) >= threshold]
+            for c, k in sorted(correlated, reverse=True)[:3]:
+                line += f'  ~{self.keys[k]} ({r[i, k]:+.2f})'
+
+            lines.append(line)
+            i += 1
+
+        return lines
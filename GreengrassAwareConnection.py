@@ -9,6 +9,8 @@
 import json
 import logging
 import os
+import threading
+import time
 import uuid
 
 from AWSIoTPythonSDK.core.greengrass.discovery.providers import DiscoveryInfoProvider
@@ -18,6 +20,10 @@ from AWSIoTPythonSDK.exception.AWSIoTExceptions import DiscoveryInvalidRequestEx
 from AWSIoTPythonSDK.MQTTLib import *
 
 
+# expectedValue of a key the shadow has never been sent
+UNREPORTED = object()
+
+
 def shadowUpdate_callback(payload, responseStatus, token):
     if responseStatus != 'accepted':
         print(f"\n Update Status: {responseStatus}")
@@ -32,8 +38,13 @@ class GreengrassAwareConnection:
     MAX_DISCOVERY_RETRIES = 10
     GROUP_CA_PATH = "./groupCA/"
     OFFLINE_QUEUE_DEPTH = 100
+    # seconds between shadow updates that send the whole state, not just what changed
+    RESYNC_INTERVAL = 3600
+    # shadow updates waiting for an answer before the next one is held back
+    MAX_IN_FLIGHT = 1
 
-    def __init__(self, host, rootCA, cert, key, thingName, stateChangeQueue = None):
+    def __init__(self, host, rootCA, cert, key, thingName, stateChangeQueue = None, resyncInterval = RESYNC_INTERVAL,
+                 deadbands = None, minIntervals = None, maxInFlight = MAX_IN_FLIGHT):
         self.logger = logging.getLogger("GreengrassAwareConnection")
         self.logger.setLevel(logging.DEBUG)
         streamHandler = logging.StreamHandler()
@@ -49,6 +60,31 @@ class GreengrassAwareConnection:
 
         self.stateChangeQueue = stateChangeQueue
 
+        # reported state the shadow has accepted, and the updates still waiting for an answer (token -> update)
+        self.reported = {}
+        self.pendingUpdates = {}
+        # answers that came back before shadowUpdate returned the token
+        self.earlyResponses = {}
+        # reentrant, in case the SDK answers on the thread that sent the update
+        self.updateLock = threading.RLock()
+        self.resyncInterval = resyncInterval
+        self.lastResync = None
+
+        # key -> how far a number may move before it is reported, and the fewest seconds between reports
+        self.deadbands = deadbands or {}
+        self.minIntervals = minIntervals or {}
+        self.lastSent = {}
+
+        self.maxInFlight = maxInFlight
+        self.queuedUpdate = None
+        self.queuedComplete = False
+        # keys held back by a deadband or minInterval, or whose update failed -- looked at again with
+        # the next update
+        self.held = {}
+        # set when an answer makes room for the queued update
+        self.windowOpen = threading.Event()
+        self.resetStats()
+
         self.backOffCore = ProgressiveBackOffCore()
 
         self.discovered = False
@@ -183,20 +219,189 @@ class GreengrassAwareConnection:
 
         self.shadowConnected = True
 
-    
-    def updateShadow(self, update):
+
+    # what the shadow will hold once the pending updates are accepted
+    def expectedState(self):
+        expected = dict(self.reported)
+        for u in self.pendingUpdates.values():
+            expected.update(u)
+
+        return expected
+
+    # what the shadow will hold for key once the pending updates are accepted -- default if nothing
+    def expectedValue(self, key, default=None):
+        for u in reversed(self.pendingUpdates.values()):
+            if key in u:
+                return u[key]
+
+        return self.reported.get(key, default)
+
+    def resyncDue(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.lastResync is None or now - self.lastResync >= self.resyncInterval
+
+    #   reports the keys of update that differ from what the shadow has (or is about to have)
+    #   accepted -- and nothing at all if none do. update can be just what changed since the last
+    #   one (e.g. StateStore.changedSince): a key is only looked at again when it changes, was held
+    #   back or its update failed. When resyncDue the caller should pass the whole state, complete,
+    #   which is sent as it is in case the shadow was changed behind our back.
+    #
+    #   A numeric key that moved no more than its deadband from the reported value, or a key sent less
+    #   than its minInterval ago, is held back -- it is looked at again with each later update, and
+    #   goes out once it has moved far enough or waited long enough.
+    #
+    #   At most maxInFlight updates wait for an answer at a time. Beyond that, update is merged into
+    #   the queued one (later values win) and goes out with the next updateShadow or sendQueued once
+    #   an answer has made room -- always from the caller's thread, never from the SDK's callback.
+    #
+    #   Returns the token, or None if skipped or queued.
+    def updateShadow(self, update, complete=False):
         if not self.isShadowConnected():
             raise ConnectionError
 
+        with self.updateLock:
+            if self.queuedUpdate is None:
+                self.queuedUpdate = dict(update)
+                self.queuedComplete = complete
+            else:
+                if len(update) > 0:
+                    self.stats['shadowUpdatesCoalesced'] += 1
+                self.queuedUpdate.update(update)
+                self.queuedComplete = self.queuedComplete or complete
+
+            return self.sendQueued()
+
+    # sends the queued update if there is room for it -- for the thread that publishes, e.g. after
+    # waiting on windowOpen
+    def sendQueued(self):
+        with self.updateLock:
+            self.windowOpen.clear()
+            if self.queuedUpdate is None or len(self.pendingUpdates) >= self.maxInFlight:
+                return None
+
+            update = self.queuedUpdate
+            self.queuedUpdate = None
+            return self.sendUpdate(update, self.queuedComplete)
+
+    # the keys of update to send now -- the ones held back go into held
+    def changedKeys(self, update, now):
+        delta = {}
+        for k, v in update.items():
+            old = self.expectedValue(k, UNREPORTED)
+            if old is not UNREPORTED:
+                if old == v:
+                    continue
+
+                # only for numbers -- a bool is an int too, but any change of one matters
+                band = self.deadbands.get(k)
+                if band is not None and isinstance(v, (int, float)) and isinstance(old, (int, float)) and \
+                        not isinstance(v, bool) and not isinstance(old, bool) and abs(v - old) <= band:
+                    self.held[k] = v
+                    continue
+
+            interval = self.minIntervals.get(k)
+            if interval is not None and k in self.lastSent and now - self.lastSent[k] < interval:
+                self.held[k] = v
+                continue
+
+            delta[k] = v
+
+        return delta
+
+    # with the updateLock held
+    #   an empty complete update (nothing read yet) is no resync -- it would report nothing and put
+    #   the real one off for a whole resyncInterval
+    def sendUpdate(self, update, complete=False):
+        now = time.monotonic()
+        if complete and len(update) > 0 and self.resyncDue(now):
+            delta = dict(update)
+            self.held.clear()
+            self.lastResync = now
+            self.stats['shadowResyncs'] += 1
+        else:
+            changed = len(update) > 0
+            if len(self.held) > 0:
+                held = self.held
+                self.held = {}
+                held.update(update)
+                update = held
+            delta = self.changedKeys(update, now)
+
+            if len(delta) == 0:
+                if changed:
+                    self.stats['shadowUpdatesSkipped'] += 1
+                return None
+
         state = {'state': {
-                    'reported': update
+                    'reported': delta
         }}
-        self.deviceShadowHandler.shadowUpdate(json.dumps(state), shadowUpdate_callback, 10)
+        token = self.deviceShadowHandler.shadowUpdate(json.dumps(state), self.shadowUpdateHandler, 10)
+
+        self.stats['shadowUpdates'] += 1
+        self.stats['shadowKeysSent'] += len(delta)
+        for k in delta:
+            self.lastSent[k] = now
+
+        self.pendingUpdates[token] = delta
+        if token in self.earlyResponses:
+            self.settleUpdate(token, self.earlyResponses.pop(token))
+
+        return token
+
+    def shadowUpdateHandler(self, payload, responseStatus, token):
+        with self.updateLock:
+            if token in self.pendingUpdates:
+                self.settleUpdate(token, responseStatus)
+
+                # the window has room again -- what was queued meanwhile is sent by the publishing
+                # thread, sending from inside the SDK's callback can deadlock it
+                if self.queuedUpdate is not None and len(self.pendingUpdates) < self.maxInFlight:
+                    self.windowOpen.set()
+            else:
+                self.earlyResponses[token] = responseStatus
+
+        if responseStatus != 'accepted':
+            shadowUpdate_callback(payload, responseStatus, token)
+
+    # a rejected or timed out update is forgotten, and its keys held to be sent again next time --
+    # unless a later update has them already
+    def settleUpdate(self, token, responseStatus):
+        update = self.pendingUpdates.pop(token)
+        if responseStatus == 'accepted':
+            self.reported.update(update)
+            return
+
+        self.stats['shadowUpdatesFailed'] += 1
+        for k, v in update.items():
+            if k in self.held or (self.queuedUpdate is not None and k in self.queuedUpdate) or \
+                    any(k in u for u in self.pendingUpdates.values()):
+                continue
+            self.held[k] = v
+
+    # returns the shadow update counters for this period and starts the next one
+    def takeStats(self):
+        with self.updateLock:
+            stats = self.stats
+            self.resetStats()
 
+        return stats
+
+    def resetStats(self):
+        self.stats = {  'shadowUpdates': 0,
+                        'shadowUpdatesSkipped': 0,
+                        'shadowUpdatesFailed': 0,
+                        'shadowUpdatesCoalesced': 0,
+                        'shadowResyncs': 0,
+                        'shadowKeysSent': 0 }
 
 
     def deleteShadow(self):
         if not self.isShadowConnected():
             raise ConnectionError
 
+        with self.updateLock:
+            self.reported = {}
+            self.held = {}
+            self.lastResync = None
+
         self.deviceShadowHandler.shadowDelete(shadowDelete_callback, 5)
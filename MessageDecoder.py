@@ -0,0 +1,101 @@
+# MessageDecoder
+#
+#   Reads back what MessageEncoder publishes, for consumers of the topics -- needs nothing outside
+#   the standard library, so it can be copied next to whatever subscribes.
+#
+#       state = decodeMessage(message, 'cbor')
+#       payload = decodePayload(message, 'json')
+#
+#   decodeCBOR handles the definite length subset of CBOR (RFC 8949), plus half floats, and skips
+#   tags. Malformed or truncated messages raise ValueError.
+#
+
+import json
+import struct
+
+
+FLOATS = { 0xF9: struct.Struct('>e'), 0xFA: struct.Struct('>f'), 0xFB: struct.Struct('>d') }
+SIMPLE = { 0xF4: False, 0xF5: True, 0xF6: None, 0xF7: None }
+
+
+# (argument, position after it) of the head at pos
+def readHead(data, pos):
+    info = data[pos] & 0x1F
+    pos += 1
+
+    if info < 24:
+        return (info, pos)
+    if info > 27:
+        raise ValueError(f'unsupported CBOR head {data[pos - 1]:02X} at {pos - 1}')
+
+    size = 1 << (info - 24)
+    if pos + size > len(data):
+        raise ValueError('truncated CBOR')
+    return (int.from_bytes(data[pos:pos + size], 'big'), pos + size)
+
+# (value, position after it) of the item at pos
+def readItem(data, pos):
+    if pos >= len(data):
+        raise ValueError('truncated CBOR')
+
+    initial = data[pos]
+    major = initial >> 5
+
+    if major == 7:
+        if initial in SIMPLE:
+            return (SIMPLE[initial], pos + 1)
+        if initial in FLOATS:
+            f = FLOATS[initial]
+            if pos + 1 + f.size > len(data):
+                raise ValueError('truncated CBOR')
+            return (f.unpack_from(data, pos + 1)[0], pos + 1 + f.size)
+        raise ValueError(f'unsupported CBOR simple value {initial:02X} at {pos}')
+
+    n, pos = readHead(data, pos)
+
+    if major == 0:
+        return (n, pos)
+    if major == 1:
+        return (-1 - n, pos)
+    if major == 2 or major == 3:
+        if pos + n > len(data):
+            raise ValueError('truncated CBOR')
+        value = bytes(data[pos:pos + n])
+        return (value if major == 2 else value.decode('utf-8'), pos + n)
+    if major == 4:
+        items = []
+        for i in range(n):
+            item, pos = readItem(data, pos)
+            items.append(item)
+        return (items, pos)
+    if major == 5:
+        items = {}
+        for i in range(n):
+            k, pos = readItem(data, pos)
+            items[k], pos = readItem(data, pos)
+        return (items, pos)
+
+    # major 6 -- a tag, just the tagged item is returned
+    return readItem(data, pos)
+
+def decodeCBOR(data):
+    value, pos = readItem(data, 0)
+    if pos != len(data):
+        raise ValueError(f'{len(data) - pos} bytes after the CBOR item')
+
+    return value
+
+
+def decodeMessage(message, encoding='json'):
+    if encoding == 'cbor':
+        return decodeCBOR(message)
+
+    return json.loads(message)
+
+def decodePayload(message, encoding='json'):
+    if encoding == 'cbor':
+        return bytes(message)
+
+    if isinstance(message, (bytes, bytearray)):
+        message = message.decode('ascii')
+    return bytes.fromhex(message)
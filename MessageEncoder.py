@@ -0,0 +1,126 @@
+# MessageEncoder
+#
+#   How messages are encoded for publishing -- pick one by name from ENCODERS.
+#
+#   json -- messages as JSON text, raw payloads as space separated hex ("0A 02 02 ..."), as always
+#   cbor -- messages as CBOR (RFC 8949), raw payloads as the payload bytes themselves
+#
+#   The CBOR encoder covers what gets published: None, bools, ints (to 64 bits), floats (as 32 bits
+#   when that is exact, else 64), str, bytes, lists/tuples/arrays and dicts, always with definite
+#   lengths. MessageDecoder reads both back.
+#
+#   The shadow service only takes JSON, so shadow updates are not affected.
+#
+
+from array import array
+import json
+import struct
+
+
+FLOAT32 = struct.Struct('>f')
+FLOAT64 = struct.Struct('>d')
+
+
+def writeHead(out, major, n):
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out.append(major << 5 | 24)
+        out.append(n)
+    elif n < 0x10000:
+        out.append(major << 5 | 25)
+        out += n.to_bytes(2, 'big')
+    elif n < 0x100000000:
+        out.append(major << 5 | 26)
+        out += n.to_bytes(4, 'big')
+    elif n < 0x10000000000000000:
+        out.append(major << 5 | 27)
+        out += n.to_bytes(8, 'big')
+    else:
+        raise ValueError(f'{n} does not fit in 64 bits')
+
+def writeItem(out, value):
+    # bool before int -- True is an int too
+    if value is None:
+        out.append(0xF6)
+    elif value is True:
+        out.append(0xF5)
+    elif value is False:
+        out.append(0xF4)
+    elif isinstance(value, int):
+        if value >= 0:
+            writeHead(out, 0, value)
+        else:
+            writeHead(out, 1, -1 - value)
+    elif isinstance(value, float):
+        try:
+            single = FLOAT32.pack(value)
+            exact = FLOAT32.unpack(single)[0] == value or value != value
+        except OverflowError as e:
+            exact = False
+
+        if exact:
+            out.append(0xFA)
+            out += single
+        else:
+            out.append(0xFB)
+            out += FLOAT64.pack(value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        writeHead(out, 3, len(encoded))
+        out += encoded
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        writeHead(out, 2, len(value))
+        out += value
+    elif isinstance(value, dict):
+        writeHead(out, 5, len(value))
+        for k, v in value.items():
+            writeItem(out, k)
+            writeItem(out, v)
+    elif isinstance(value, (list, tuple, array)):
+        writeHead(out, 4, len(value))
+        for v in value:
+            writeItem(out, v)
+    else:
+        raise TypeError(f'cannot encode {type(value).__name__} as CBOR')
+
+def encodeCBOR(value):
+    out = bytearray()
+    writeItem(out, value)
+    return bytes(out)
+
+
+class MessageEncoder:
+    name = None
+
+    # a dict (state, stats, telemetry ...) -> str or bytes to publish
+    def encode(self, message):
+        pass
+
+    # a raw frame payload -> str or bytes to publish
+    def encodePayload(self, payload):
+        pass
+
+
+class JSONMessageEncoder(MessageEncoder):
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def encodePayload(self, payload):
+        return ' '.join(f'{b:02X}' for b in payload)
+
+
+class CBORMessageEncoder(MessageEncoder):
+    name = 'cbor'
+
+    def encode(self, message):
+        return encodeCBOR(message)
+
+    def encodePayload(self, payload):
+        return bytes(payload)
+
+
+ENCODERS = {    JSONMessageEncoder.name: JSONMessageEncoder,
+                CBORMessageEncoder.name: CBORMessageEncoder }
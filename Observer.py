@@ -77,9 +77,10 @@ class ObservableString(Observable):
         self.chunk = b''
 
     # call to add to the end of the chunk, notifies observers
+    #   the chunk is cleared after every notify, so the increment is passed on as-is (no copy)
     def append(self, increment):
         if len(increment) > 0:
-            self.chunk = self.chunk + increment
+            self.chunk = increment
 
             self.notifyObservers(self.chunk)
             self.clear()
@@ -133,7 +134,14 @@ class ObservableDict(Observable):
             self.dict.update(newDict)
 
             self.notifyObservers(self.dict)
-            
+
+    # merges newDict without notifying -- returns True if there was anything to merge
+    def merge(self, newDict):
+        self.dict.update(newDict)
+        return len(newDict) > 0
+
+    def notifyChanged(self):
+        self.notifyObservers(self.dict)
 
     def getDict(self):
         return self.dict
@@ -0,0 +1,243 @@
+# PayloadSchema
+#
+#   Payloads declared as data instead of Payload subclasses.
+#
+#   A Schema is a list of Fields -- name, offset and width in the payload body (big endian), then
+#   optionally mask, shift, signed, flag (value != 0), lookup (value -> anything) and scale, applied
+#   in that order. Each Schema is compiled once into a decode(body) function that reads the fields with
+#   one precompiled struct layout and builds the status dict in a single expression -- one-byte fields
+#   with any conversion become a 256-entry table. Fields that overlap another, or are not 1, 2, 4 or 8
+#   bytes wide, are read from the body bytes instead.
+#
+#   A PayloadRegistry maps (type, command) to a Schema, or to a hand written decoder for payloads
+#   too irregular to declare (e.g. StatusPayload). compile() returns the dispatch table -- a plain
+#   dict, so an unknown (type, command) is just a .get() miss.
+#
+#   compile(keys) projects the table onto the keys someone actually consumes: (type, command)s that
+#   produce none of them are left out, and the rest decode only the requested keys.
+#
+#   e.g. to decode a new message:
+#
+#       PAYLOADS.register(0x00, 0x06, Schema('PumpStatus', [ Field('pumpStarted', 0, mask=0x0A, flag=True) ]))
+#
+
+
+import struct
+
+
+# struct codes for the field widths a layout can read -- unsigned, signed
+CODES = { 1: ('B', 'b'), 2: ('H', 'h'), 4: ('I', 'i'), 8: ('Q', 'q') }
+
+
+class Field:
+    def __init__(self, name, offset, width=1, mask=None, shift=0, signed=False, flag=False, lookup=None, scale=1):
+        self.name = name
+        self.offset = offset
+        self.width = width
+        self.mask = mask
+        self.shift = shift
+        self.signed = signed
+        self.flag = flag
+        self.lookup = lookup
+        self.scale = scale
+
+        self.end = offset + width
+        self.bits = (mask.bit_length() if mask is not None else 8 * width) - shift
+
+    # raw (unconverted) value from the body
+    def read(self, body):
+        return int.from_bytes(body[self.offset:self.end], 'big')
+
+    def convert(self, v):
+        if self.mask is not None:
+            v &= self.mask
+        v >>= self.shift
+
+        if self.signed and v >= 1 << (self.bits - 1):
+            v -= 1 << self.bits
+
+        if self.flag:
+            return v != 0
+        if self.lookup is not None:
+            return self.lookup.get(v)
+        if self.scale != 1:
+            return v * self.scale
+
+        return v
+
+    def isPlain(self):
+        return self.mask is None and self.shift == 0 and not self.signed and not self.flag and \
+            self.lookup is None and self.scale == 1
+
+    # only signed -- a signed struct code reads the finished value
+    def isSignedOnly(self):
+        return self.mask is None and self.shift == 0 and self.signed and not self.flag and \
+            self.lookup is None and self.scale == 1
+
+    # source for the raw value
+    def rawSource(self):
+        return ' | '.join(f'body[{self.offset + i}] << {8 * (self.width - 1 - i)}' if i < self.width - 1
+                            else f'body[{self.offset + i}]' for i in range(self.width))
+
+
+#   size -- bodies shorter than this decode only the fields that fit (default: end of the last field)
+#   exact -- bodies of any other size decode to {}
+class Schema:
+    def __init__(self, name, fields, size=None, exact=False):
+        self.name = name
+        self.fields = fields
+        self.size = size if size is not None else max(f.end for f in fields)
+        self.exact = exact
+
+        self.keys = tuple(f.name for f in fields)
+        self.decoder = None
+        # frozenset of keys -> compiled projection
+        self.projections = {}
+
+    def partial(self, body):
+        return { f.name: f.convert(f.read(body)) for f in self.fields if f.end <= len(body) }
+
+    def compile(self):
+        if self.decoder is not None:
+            return self.decoder
+
+        namespace = { 'partial': self.partial }
+
+        # the fields one struct layout can read: within size, of a struct width and not overlapping
+        # any other field
+        laid = [f for f in self.fields if f.width in CODES and f.end <= self.size and
+                    not any(g is not f and g.offset < f.end and f.offset < g.end for g in self.fields)]
+        laid.sort(key=lambda f: f.offset)
+        layout = '>'
+        end = 0
+        for f in laid:
+            if f.offset > end:
+                layout += f'{f.offset - end}x'
+            layout += CODES[f.width][f.isSignedOnly()]
+            end = f.end
+        names = { id(f): f'v{i}' for i, f in enumerate(laid) }
+        namespace['unpack'] = struct.Struct(layout).unpack_from
+
+        entries = []
+        for i, f in enumerate(self.fields):
+            if id(f) in names:
+                raw = names[id(f)]
+            else:
+                raw = f.rawSource()
+
+            if f.isPlain() or (id(f) in names and f.isSignedOnly()):
+                value = raw
+            elif f.width == 1:
+                namespace[f'T{i}'] = tuple(f.convert(b) for b in range(256))
+                value = f'T{i}[{raw}]'
+            else:
+                namespace[f'C{i}'] = f.convert
+                value = f'C{i}({raw})'
+
+            entries.append(f'{f.name!r}: {value}')
+
+        source = f'def decode(body):\n'
+        if self.exact:
+            source += f'    if len(body) != {self.size}:\n        return {{}}\n'
+        else:
+            source += f'    if len(body) < {self.size}:\n        return partial(body)\n'
+        if len(laid) > 0:
+            source += '    ' + ', '.join(names[id(f)] for f in laid) + (',' if len(laid) == 1 else '') + ' = unpack(body)\n'
+        source += '    return { ' + ',\n             '.join(entries) + ' }\n'
+
+        exec(compile(source, f'<schema {self.name}>', 'exec'), namespace)
+        self.decoder = namespace['decode']
+        self.decoder.__qualname__ = self.decoder.__name__ = f'{self.name}.decode'
+        self.decoder.source = source
+
+        return self.decoder
+
+    # decode(body) for just the fields in keys
+    def project(self, keys):
+        keys = frozenset(keys)
+        if keys not in self.projections:
+            fields = [f for f in self.fields if f.name in keys]
+            self.projections[keys] = Schema(self.name, fields, self.size, self.exact).compile()
+
+        return self.projections[keys]
+
+
+# projection of a hand written decoder that has no project() of its own -- decodes everything, then filters
+def filtered(decoder, keys):
+    keys = frozenset(keys)
+
+    def decode(body):
+        return { k: v for k, v in decoder(body).items() if k in keys }
+
+    return decode
+
+
+class PayloadRegistry:
+    def __init__(self):
+        # (type, command) -> (name, decoder, keys, project)
+        self.entries = {}
+        # the (type, command)s whose decoder costs more than a cache lookup -- see PentairProtocol
+        self.cached = set()
+
+    #   decoder is a Schema, or a function body -> status dict that produces the given keys
+    #   project(keys) returns a decoder for a subset of the keys (default: filter the full decode)
+    #   cache is for slow decoders only -- a compiled Schema decodes faster than its payload is looked up
+    def register(self, commandType, command, decoder, keys=None, name=None, project=None, cache=False):
+        if isinstance(decoder, Schema):
+            self.entries[(commandType, command)] = (name or decoder.name, decoder.compile(), decoder.keys,
+                                                    decoder.project)
+        else:
+            if project is None:
+                project = lambda subset: filtered(decoder, subset)
+            self.entries[(commandType, command)] = (name or decoder.__qualname__, decoder, tuple(keys or ()),
+                                                    project)
+
+        if cache:
+            self.cached.add((commandType, command))
+        else:
+            self.cached.discard((commandType, command))
+
+    def unregister(self, commandType, command):
+        self.entries.pop((commandType, command), None)
+        self.cached.discard((commandType, command))
+
+    def name(self, commandType, command):
+        return self.entries[(commandType, command)][0]
+
+    def keys(self, commandType, command):
+        return self.entries[(commandType, command)][2]
+
+    # every key any registered payload produces
+    def allKeys(self):
+        return set(k for name, decoder, keys, project in self.entries.values() for k in keys)
+
+    # (type, command) -> the other (type, command)s that produce at least one of the same keys
+    def overlaps(self):
+        return { k: tuple(other for other, (n, d, otherKeys, p) in self.entries.items()
+                            if other != k and not set(keys).isdisjoint(otherKeys))
+                 for k, (name, decoder, keys, project) in self.entries.items() }
+
+    # (type, command) -> ((key, the other (type, command)s that produce it) ...) for each of its keys
+    # another payload produces too
+    def sharedKeys(self):
+        return { k: tuple((key, tuple(other for other, (n, d, otherKeys, p) in self.entries.items()
+                                      if other != k and key in otherKeys))
+                          for key in keys
+                          if any(other != k and key in otherKeys
+                                 for other, (n, d, otherKeys, p) in self.entries.items()))
+                 for k, (name, decoder, keys, project) in self.entries.items() }
+
+    # (type, command) -> decode(body) -- for only the given keys, if any
+    def compile(self, keys=None):
+        if keys is None:
+            return { k: decoder for k, (name, decoder, produced, project) in self.entries.items() }
+
+        decoders = {}
+        for k, (name, decoder, produced, project) in self.entries.items():
+            wanted = set(keys).intersection(produced)
+            if len(wanted) == len(produced):
+                decoders[k] = decoder
+            elif len(wanted) > 0:
+                decoders[k] = project(wanted)
+
+        return decoders
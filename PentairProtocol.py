@@ -1,8 +1,12 @@
+from collections import namedtuple
 from collections.abc import Iterable
 from functools import reduce
 import json
 import re
 import struct
+import time
+
+from PayloadSchema import Field, PayloadRegistry, Schema
 
 
 
@@ -29,13 +33,19 @@ class Payload:
         #     self.dump()
         return self.status
 
+    # status dict for a payload body -- hot payloads override this with a precompiled decoder
+    # that skips building the Payload object at all
+    @classmethod
+    def decode(cls, body):
+        return cls(body).getStatus()
+
 #
 # lots of payload cracking things taken from
 #   https://docs.google.com/document/d/1M0KMfXfvbszKeqzu6MUF_7yM6KDHk8cZ5nrH1_OUcAc/edit
 #
 
-class DatePayload(Payload):
-    DAY = { 0x01: "Sunday",
+# dow is a bit shift 0x01 << <ordinal DOW - Sun == 0, Sat == 6)
+DAYS = {    0x01: "Sunday",
             0x02: "Monday",
             0x04: "Tuesday",
             0x08: "Wednesday",
@@ -43,21 +53,29 @@ class DatePayload(Payload):
             0x20: "Friday",
             0x40: "Saturday" }
 
+# a Payload declared as a Schema -- XPayload(body).getStatus() works as always, and XPayload.decode is the
+# compiled schema itself (set after each class)
+class SchemaPayload(Payload):
+    SCHEMA = None
+
     def __init__(self, body):
         super().__init__(body)
+        self.status = self.decode(body)
 
-        try:
-            self.status['hour'] = self.body[0]
-            self.status['min'] = self.body[1]
-            # dow is a bit shift 0x01 << <ordinal DOW - Sun == 0, Sat == 6)
-            self.status['dow'] = self.DAY[self.body[2]]
-            self.status['day'] = self.body[3]
-            self.status['month'] = self.body[4]
-            self.status['year'] = self.body[5]
-            self.status['adjust'] = self.body[6]
-            self.status['dst'] = self.body[7]
-        except Exception as err:
-            pass
+
+class DatePayload(SchemaPayload):
+    DAY = DAYS
+
+    SCHEMA = Schema('DatePayload', [    Field('hour', 0),
+                                        Field('min', 1),
+                                        Field('dow', 2, lookup=DAYS),
+                                        Field('day', 3),
+                                        Field('month', 4),
+                                        Field('year', 5),
+                                        Field('adjust', 6),
+                                        Field('dst', 7) ])
+
+DatePayload.decode = staticmethod(DatePayload.SCHEMA.compile())
 
 
 class StatusPayload(Payload):
@@ -97,130 +115,164 @@ class StatusPayload(Payload):
     HEATER_SPA_OFF      = 0x00
     HEATER_SPA_EN       = 0x10
 
-    def __init__(self, body):
-        super().__init__(body)
-
-        try:
-            self.status['hour'] = self.body[0]
-            self.status['min'] = self.body[1]
+    # everything the decoder reads, in one unpack:
+    #   hour, min, circuits (2), circuits (3), bytes 4 - 7, mode (9), heater (10), byte 11, delay (12),
+    #   water (14), spa (15), air (18), solar (19), heat modes (22)
+    LAYOUT = struct.Struct('>BBBBIxBBBBxBBxxBBxxB')
 
-            self.status['spa'] = (self.body[2] & self.SPA) != 0
-            self.status['aux1'] = (self.body[2] & self.AUX1) != 0
-            self.status['aux2'] = (self.body[2] & self.AUX2) != 0
-            self.status['aux3'] = (self.body[2] & self.AUX3) != 0
-            self.status['pool'] = (self.body[2] & self.POOL) != 0
-            self.status['feature1'] = (self.body[2] & self.FEATURE1) != 0
-            self.status['feature2'] = (self.body[2] & self.FEATURE2) != 0
-            self.status['feature3'] = (self.body[2] & self.FEATURE3) != 0
+    KEYS = ('hour', 'min',
+            'spa', 'aux1', 'aux2', 'aux3', 'pool', 'feature1', 'feature2', 'feature3', 'feature4',
+            'runMode', 'tempUnits', 'freezeProtect', 'timeout', 'heater', 'delay',
+            'waterTemp', 'spaTemp', 'airTemp', 'solarTemp', 'poolHeaterMode', 'spaHeaterMode')
 
-            self.status['feature4'] = (self.body[3] & self.FEATURE4) != 0
+    def __init__(self, body):
+        super().__init__(body)
+        self.status = self.decode(body)
+
+    # values read straight from the body rather than from the tables
+    DIRECT_KEYS = ('hour', 'min', 'waterTemp', 'spaTemp', 'airTemp', 'solarTemp')
+
+    # combinations of circuits, modes and flags to keep merged -- a controller only ever shows a few
+    FLAGS_CACHE_SIZE = 256
+
+    # decode(body) producing only the given keys -- the tables are cut down to them, and the few values
+    # read directly are dropped after
+    #   StatusPayload.decode is the projection to all KEYS
+    @staticmethod
+    def project(keys):
+        keys = set(keys)
+        byCircuits = tuple({ k: v for k, v in t.items() if k in keys } for t in STATUS_BY_CIRCUITS)
+        rest = tuple({ k: v for k, v in t.items() if k in keys } for t in STATUS_REST)
+        drop = tuple(k for k in StatusPayload.DIRECT_KEYS if k not in keys)
+
+        # byte 2 | the STATUS_REST index << 8 -> the two tables' entries merged, to be copied
+        #   the bytes read directly (hour, temperatures ...) change far more often than these do
+        merged = {}
+        cacheSize = StatusPayload.FLAGS_CACHE_SIZE
+
+        size = StatusPayload.LAYOUT.size
+        unpack = StatusPayload.LAYOUT.unpack_from
+        FEATURE4 = StatusPayload.FEATURE4
+        HEATER_ON = StatusPayload.HEATER_ON
+        DELAY = StatusPayload.DELAY
+
+        def decode(body):
+            if len(body) < size:
+                return {}
+
+            (hour, minute, circuits, circuits2, zeros, mode, heater, byte11, delay,
+                water, spa, air, solar, heatModes) = unpack(body)
 
             # byte 4 - 8 are 0
-            if reduce((lambda x, sum: sum + x), self.body[4:8]) != 0:
+            if zeros != 0:
                 print('unusual bytes 4 - 8 in StatusPayload')
 
-            self.status['runMode'] = self.body[9] & self.RUN_MODE
-            self.status['tempUnits'] = self.body[9] & self.TEMP_UNITS
-            self.status['freezeProtect'] = self.body[9] & self.FREEZE_PROTECT            
-            self.status['timeout'] = self.body[9] & self.TIMEOUT
-
             # if body[10] != self.HEATER_OFF and body[10] != self.HEATER_ON:
             #     print(f'unusual heater setting in StatusPayload {body[10]:02X}')
-            self.status['heater'] = (self.body[10] == self.HEATER_ON)
 
-            if self.body[11] != 0:
+            if byte11 != 0:
                 print('unusual byte 11 in StatusPayload')
-            
+
             # if (body[12] & 0x30) != 0x30:
             #     print(f'unusual byte 12 in StatusPayload {body[12]:02X}')
-            self.status['delay'] = (self.body[12] & self.DELAY) != 0
-
-            self.status['waterTemp'] = self.body[14] # repeated in body[15]
-            self.status['spaTemp'] = self.body[15]
-            self.status['airTemp'] = self.body[18]
-            self.status['solarTemp'] = self.body[19]
-
-            self.status['poolHeaterMode'] = (self.body[22] & 0x03)
-            self.status['spaHeaterMode'] = ((self.body[22] & 0x0C) >> 2)
-        
-        except Exception as err:
-            pass
-
-
-class PumpPayload(Payload):
-    # sample:  
-    # 00,10,60,07,0F,0A 02 02 03 11 09 60 00 00 00 00 00 01 13 3B
-    def __init__(self, body):
-        super().__init__(body)
-        try:
-            self.status['pumpStarted'] = (self.body[0] & 0x0A) != 0
 
-            (self.status['pumpMode'],
-            self.status['pumpState'],
-            self.status['pumpWatts'],
-            self.status['pumpRPM'] ) = struct.unpack(">BBHHxx", self.body[1:9])
-
-            # print(f"read RPM {self.status['pumpRPM']} from:"); self.dumpBody()
-
-            # there are a lot more bytes... seem to be sequence number...
-        except Exception as err:
-            pass
-
-
-class PingPayload(Payload):
-    # think this is just a ping to see if the other party is alive
-    def __init__(self, body):
-        super().__init__(body)
-        try:
-            if self.body[0] != 0xFF:
-                print(f'unkown ping data: {body[0]:02X}')
-        except Exception as err:
-            pass
-
-    def dump(self):
-        pass
-
-class PumpStatus(Payload):
-    PUMP_STARTED = 0x0A
-    PUMP_STOPPED = 0x04
-
-    def __init__(self, body):
-        super().__init__(body)
-
-        try:
-            self.status['pumpStarted'] = (self.body[0] & 0x0A) != 0
-        except Exception as err:
-            pass
+            i = (circuits |
+                 (mode & 0x1F) << 8 |
+                 (circuits2 & FEATURE4) << 13 |
+                 (heater == HEATER_ON) << 14 |
+                 (delay & DELAY != 0) << 15 |
+                 (heatModes & 0x0F) << 16)
+            flags = merged.get(i)
+            if flags is None:
+                if len(merged) >= cacheSize:
+                    merged.clear()
+                flags = byCircuits[circuits].copy()
+                flags.update(rest[i >> 8])
+                merged[i] = flags
+
+            # copying a full-size dict is much cheaper than growing a new one key by key
+            status = flags.copy()
+            status['hour'] = hour
+            status['min'] = minute
+            status['waterTemp'] = water         # repeated in body[15]
+            status['spaTemp'] = spa
+            status['airTemp'] = air
+            status['solarTemp'] = solar
+
+            if drop:
+                for k in drop:
+                    del status[k]
+
+            return status
+
+        return decode
+
+
+# lookup tables for StatusPayload.project
+#
+#   byte 2 -> a complete status (in KEYS order) with that byte's circuits filled in
+STATUS_BY_CIRCUITS = tuple(dict(dict.fromkeys(StatusPayload.KEYS, 0),
+                                spa=(b & StatusPayload.SPA) != 0,
+                                aux1=(b & StatusPayload.AUX1) != 0,
+                                aux2=(b & StatusPayload.AUX2) != 0,
+                                aux3=(b & StatusPayload.AUX3) != 0,
+                                pool=(b & StatusPayload.POOL) != 0,
+                                feature1=(b & StatusPayload.FEATURE1) != 0,
+                                feature2=(b & StatusPayload.FEATURE2) != 0,
+                                feature3=(b & StatusPayload.FEATURE3) != 0)
+                           for b in range(256))
+#   byte 9 -> runMode, tempUnits, freezeProtect, timeout
+STATUS_MODES = tuple({  'runMode': b & StatusPayload.RUN_MODE,
+                        'tempUnits': b & StatusPayload.TEMP_UNITS,
+                        'freezeProtect': b & StatusPayload.FREEZE_PROTECT,
+                        'timeout': b & StatusPayload.TIMEOUT } for b in range(256))
+#   feature4 | heater << 1 | delay << 2 | low nibble of byte 22 << 3 -> the remaining flags
+STATUS_FLAGS = tuple({  'feature4': (i & 0x01) != 0,
+                        'heater': (i & 0x02) != 0,
+                        'delay': (i & 0x04) != 0,
+                        'poolHeaterMode': (i >> 3) & 0x03,
+                        'spaHeaterMode': (i >> 5) & 0x03 } for i in range(128))
+#   the two combined, for a single update -- the mode bits of byte 9 (0x1F) | the flags index << 5
+STATUS_REST = tuple({ **STATUS_MODES[i & 0x1F], **STATUS_FLAGS[i >> 5] } for i in range(32 * 128))
+
+StatusPayload.decode = staticmethod(StatusPayload.project(StatusPayload.KEYS))
+
+
+# sample:
+# 00,10,60,07,0F,0A 02 02 03 11 09 60 00 00 00 00 00 01 13 3B
+#   started, mode, state, watts, rpm -- there are a lot more bytes... seem to be sequence number...
+class PumpPayload(SchemaPayload):
+    SCHEMA = Schema('PumpPayload', [    Field('pumpStarted', 0, mask=0x0A, flag=True),
+                                        Field('pumpMode', 1),
+                                        Field('pumpState', 2),
+                                        Field('pumpWatts', 3, 2),
+                                        Field('pumpRPM', 5, 2) ], size=9)
+
+PumpPayload.decode = staticmethod(PumpPayload.SCHEMA.compile())
 
-class CommandPayload(Payload):
-    def __init__(self, body):
-        super().__init__(body)
-        # print("Command Payload")
-        self.dumpBody()
-
-        try:
-            # (self.status['pumpRPM'],) = struct.unpack(">H", self.body[-2:])
-            # print(f"read RPM {self.status['pumpRPM']} from:"); self.dumpBody()
-            pass
-        except Exception as err:
-            pass
 
 # 24,0F,10,08,0D,4C 4C 3D 55 64 00 00 00 00 00 00 00 00
 # temperatures: water water air water-set spa-set
-class TempPayload(Payload):
-    def __init__(self, body):
-        super().__init__(body)
-
-        try:
-            # 8 unused bytes... probably solar and other features I don't have
-            (self.status['waterTemp'],
-            self.status['spaTemp'],
-            self.status['airTemp'],
-            self.status['poolSetTemp'],
-            self.status['spaSetTemp']) = struct.unpack("bbbbbxxxxxxxx", self.body)
-
-        except Exception as err:
-            pass
+#   8 unused bytes... probably solar and other features I don't have
+class TempPayload(SchemaPayload):
+    SCHEMA = Schema('TempPayload', [    Field('waterTemp', 0, signed=True),
+                                        Field('spaTemp', 1, signed=True),
+                                        Field('airTemp', 2, signed=True),
+                                        Field('poolSetTemp', 3, signed=True),
+                                        Field('spaSetTemp', 4, signed=True) ], size=13, exact=True)
+
+TempPayload.decode = staticmethod(TempPayload.SCHEMA.compile())
+
+
+# (type, command) -> decoder for the payload
+PAYLOADS = PayloadRegistry()
+PAYLOADS.register(0x00, 0x07, PumpPayload.SCHEMA)
+PAYLOADS.register(0x24, 0x02, StatusPayload.decode, StatusPayload.KEYS, 'StatusPayload', StatusPayload.project,
+                  cache=True)
+PAYLOADS.register(0x24, 0x05, DatePayload.SCHEMA)
+PAYLOADS.register(0x24, 0x08, TempPayload.SCHEMA)
+# not decoded: 0x00/0x01 is really an ACKnowledgement of the cmd in the payload, 0x00/0x04 a ping
+# (body FF), 0x00/0x06 pump status (pumpStarted, as in 0x00/0x07)
 
 #
 # A Command
@@ -304,21 +356,55 @@ class HeatChangeCommand(Command):
         pass
 
 
+# a parsed frame -- immutable, and the payload is a memoryview into the (immutable) bytes it was read
+# from rather than a copy
+#
+#   unchanged is True when the payload is the same as the last one of its (type, command) and no
+#   payload producing any of the same keys has changed since -- merging its state would change nothing
+#
+#   state may be shared with other frames (see the decode cache in PentairProtocol) -- don't modify it
+class Frame(namedtuple('Frame', ['type', 'destination', 'source', 'command', 'payloadLength', 'payload', 'state',
+                                 'unchanged'])):
+    __slots__ = ()
+
+
 class PentairProtocol:
     RECORD_SEPARATOR = b'\xFF\x00\xFF'
     IDLE_BYTE = b'\xFF'
     START_BYTE = 0xA5
 
-    def __init__(self):
-        self.payloads = {
-            0x00: { #0x01: CommandPayload,  # this is really an ACKnowledgement of the cmd in the payload
-                    #0x04: PingPayload,
-                    #0x06: PumpStatus,
-                    0x07: PumpPayload },
-            0x24: { 0x02: StatusPayload,
-                    0x05: DatePayload,
-                    0x08: TempPayload }
-        }
+    # command code of the controller's ACK -- the payload is the command being ack'd
+    ACK = 0x01
+
+    # START_BYTE, type, destination, source, command, payloadLength
+    HEADER_LENGTH = 6
+    LENGTH_OFFSET = 5
+    CHECKSUM_LENGTH = 2
+
+    # decoded payloads to remember of each cached (type, command) -- the controller rebroadcasts
+    # identical frames every few seconds
+    CACHE_SIZE = 64
+
+    def __init__(self, cacheSize=CACHE_SIZE):
+        # (type, command) -> { payload bytes: decoded state }, oldest first -- only for the payloads
+        # registered with cache=True (see PayloadRegistry)
+        #   lookups use the frame's (read only) memoryview directly -- it hashes and compares like the bytes
+        self.cacheSize = cacheSize
+        self.caches = {}
+
+        # (type, command) -> last payload, and the last value of each key more than one payload
+        # produces -- for Frame.unchanged
+        self.lastPayloads = {}
+        self.sharedValues = {}
+
+        # state keys the consumers of frames have asked for -- everything until someone asks
+        self.consumers = 0
+        self.everything = False
+        self.requested = set()
+
+        # (type, command) -> decode(body) -- see PayloadSchema
+        self.shared = PAYLOADS.sharedKeys()
+        self.compileDecoders()
 
         self.commandPayloads = {
             'spa': CircuitChangeCommand, 
@@ -344,27 +430,63 @@ class PentairProtocol:
         # "pumpStarted","pumpMode", "pumpState", "pumpWatts", "pumpRPM", "waterTemp", "spaTemp"
 
 
+        # command code -> time sent, for commands still waiting on an ACK
+        self.pendingAcks = {}
+
         self.resetStats()
 
+    # a consumer of frames that only uses these state keys (None for all of them) -- payloads that
+    # produce no key any consumer uses are ignored, the rest decode only the keys that are used
+    def addConsumer(self, keys=None):
+        self.consumers += 1
+        if keys is None:
+            self.everything = True
+        else:
+            self.requested.update(keys)
+
+        self.compileDecoders()
+
+    def compileDecoders(self):
+        keys = None if self.consumers == 0 or self.everything else self.requested
+        self.decoders = PAYLOADS.compile(keys)
+        # known, but of no interest
+        self.ignored = PAYLOADS.entries.keys() - self.decoders.keys()
+
+        self.caches = { k: {} for k in self.decoders.keys() & PAYLOADS.cached }
+        self.lastPayloads.clear()
+        self.sharedValues.clear()
+
     def getStats(self):
         return self.stats
 
     def resetStats(self):
         self.stats= {   'frameCount': 0,
                         'badFrames': 0,
-                        'unprocessedPayloads': 0 }
+                        'salvagedFrames': 0,
+                        'lostFrames': 0,
+                        'unprocessedPayloads': 0,
+                        'ignoredPayloads': 0,
+                        'unackedCommands': 0,
+                        'cacheHits': 0,
+                        'cacheMisses': 0 }
 
     # computes checksum for a frame 
     #   if using an incoming frame, strip off the checksum before calling -- e..g f[:-2]
     # otherwise, frame should include the START_BYTE and otherwise be stripped from IDLE_BYTES
+    #   (the builtin sum is several times faster than reduce with a lambda)
     def checkSum(self, frame):
-        cs = reduce((lambda x, sum: sum + x), frame)
-        return cs
+        return sum(frame)
+
+    # checks the checksum of the exact frame data[start:end] without copying it out or counting stats
+    #   used to resync inside a corrupted stream (see StreamDeframer)
+    def validChecksum(self, data, start, end):
+        return ((data[end - 2] << 8) + data[end - 1]) == self.checkSum(data[start:end - 2])
 
     #
     # validFrame
     #
-    #   returns validity of the unpadded frame (that is, remove padding before calling)
+    #   returns validity of the frame -- trailing IDLE_BYTEs are stripped unless padded is False
+    #   (exact frames from StreamDeframer must not be stripped, the checksum may end in 0xFF)
     #
     #   A frame has:
     #       START_BYTE      1 bytes -- but this is stripped...
@@ -376,9 +498,10 @@ class PentairProtocol:
     #   that is... the full frame less the check sum.  The checksum is the sum of START, version,
     #   and all databytes modulo 2^16
     #
-    def validFrame(self, f):
+    def validFrame(self, f, padded=True):
         try:
-            f = f.rstrip(self.IDLE_BYTE)
+            if padded:
+                f = f.rstrip(self.IDLE_BYTE)
             # valid = f[0] == self.START_BYTE and ((f[-2] << 8) + f[-1]) & 0xFFFF == reduce((lambda x, sum: sum + x), f[:-2])
             valid = f[0] == self.START_BYTE and ((f[-2] << 8) + f[-1]) & 0xFFFF == self.checkSum(f[:-2])
             
@@ -390,57 +513,124 @@ class PentairProtocol:
         return valid
 
     #
-    #   parsePayloadFromFrame
+    #   parsePayload
     #
-    def parsePayloadFromFrame(self, frame):
-        state = {}
+    #   returns the cached state when this exact payload was decoded recently -- for the cached
+    #   (type, command)s, everything else is decoded every time
+    #
+    def parsePayload(self, commandType, command, payload):
+        key = (commandType, command)
+        decode = self.decoders.get(key)
+        if decode is None:
+            if key in self.ignored:
+                self.stats['ignoredPayloads'] += 1
+            else:
+                self.stats['unprocessedPayloads'] += 1
+            return {}
 
-        try:
-            if frame['payloadLength'] != len(frame['payload']):
-                raise Exception                         
+        cache = self.caches.get(key)
+        if cache is None:
+            return decode(payload)
 
-            payload = self.payloads[frame['type']][frame['command']](frame['payload'])
-            # self.state.update(payload.getStatus())       # just overwrite ... and get the latest
-            state = payload.getStatus()
-            # payload.dump()
+        state = cache.get(payload)
+        if state is not None:
+            self.stats['cacheHits'] += 1
+            return state
+
+        self.stats['cacheMisses'] += 1
+        state = decode(payload)
+
+        if self.cacheSize > 0:
+            # oldest out -- cheaper than keeping the order of use on every hit
+            if len(cache) >= self.cacheSize:
+                del cache[next(iter(cache))]
+            # copy the payload -- a view would keep the whole chunk it came from alive
+            cache[bytes(payload)] = state
 
-        except Exception as err:
-            self.stats['unprocessedPayloads'] += 1
-            # print(err)
-        #     print(",".join(list(map((lambda x: f'{x:02X}' if not isinstance(x, Iterable) else ' '.join(f'{b:02X}' for b in x) if len(x) > 0  else ''), list(frame.values())))))
-                
         return state
 
+    # is this payload the same as the last of its (type, command), with none of its keys changed since?
+    #
+    #   Payloads that share keys (status, date, temperatures ...) only make each other stale when one
+    #   of them actually changes a shared value -- not just by arriving with a different payload
+    def isUnchanged(self, commandType, command, payload, state):
+        k = (commandType, command)
+        if self.lastPayloads.get(k) == payload:
+            return True
+
+        self.lastPayloads[k] = bytes(payload)
+        for key, others in self.shared.get(k, ()):
+            # not decoded for any consumer, or the same as before
+            if key not in state or (key in self.sharedValues and self.sharedValues[key] == state[key]):
+                continue
+
+            self.sharedValues[key] = state[key]
+            for other in others:
+                self.lastPayloads.pop(other, None)
+
+        return False
+
 
     #
     #   parseFrame
     #
-    #   returns a dict with the parsed components of the frame 
-    #   DOES NOT PARSE PAYLOAD or SPECIFIC MESSAGE CODES
+    #   returns a Frame with the parsed components of the frame and the decoded payload as its state
+    #   -- or None if the frame is not valid
+    #
+    #   padded frames (e.g. from splitting on RECORD_SEPARATOR) have IDLE_BYTEs stripped first. The
+    #   checksum is checked here rather than with validFrame so the frame is only stripped once.
     #
-    def parseFrame(self, f):
+    def parseFrame(self, f, padded=True):
         self.stats['frameCount'] += 1
-        f = f.rstrip(self.IDLE_BYTE)
+        if padded:
+            f = f.rstrip(self.IDLE_BYTE)
 
-        if not self.validFrame(f):
-            return {}
+        # too short for a header and checksum -- 'empty' frames are not counted as bad
+        if len(f) < self.HEADER_LENGTH + self.CHECKSUM_LENGTH:
+            return None
+
+        # summing the whole frame and taking the checksum bytes back out saves slicing it
+        if f[0] != self.START_BYTE or ((f[-2] << 8) + f[-1]) != self.checkSum(f) - f[-2] - f[-1]:
+            self.stats['badFrames'] += 1
+            return None
+
+        return self.decodeFrame(f)
+
+    # the Frame for an exact frame that has already been validated (e.g. by BatchDecoder)
+    def decodeFrame(self, f):
+        # the payload view is a cache key (and kept by the Frame) -- it must not be able to change
+        if isinstance(f, memoryview):
+            if not f.readonly:
+                f = memoryview(bytes(f))
+        elif isinstance(f, bytes):
+            f = memoryview(f)
+        else:
+            f = memoryview(bytes(f))
 
-        parsed = {}
-        try:
-            parsed['type'] = f[1]
-            parsed['destination'] = f[2]
-            parsed['source'] = f[3]
-            parsed['command'] = f[4]
+        payload = f[self.HEADER_LENGTH:-self.CHECKSUM_LENGTH]
+        commandType = f[1]
+        command = f[4]
 
-            parsed['payloadLength'] = f[5]
-            parsed['payload'] = f[6:-2]
+        if f[5] == len(payload):
+            state = self.parsePayload(commandType, command, payload)
+            unchanged = len(state) > 0 and self.isUnchanged(commandType, command, payload, state)
+        else:
+            self.stats['unprocessedPayloads'] += 1
+            state = {}
+            unchanged = False
 
-            parsed['state'] = self.parsePayloadFromFrame(parsed)
+        if command == self.ACK and commandType == 0x24 and len(self.pendingAcks) > 0 and len(payload) > 0:
+            self.pendingAcks.pop(payload[0], None)
 
-        except Exception as e:
-            pass
+        return Frame(commandType, f[2], f[3], command, f[5], payload, state, unchanged)
 
-        return parsed
+    # counts (and forgets) commands that have waited longer than timeout seconds for an ACK
+    def checkAcks(self, timeout):
+        now = time.monotonic()
+        for c, sent in list(self.pendingAcks.items()):
+            if now - sent > timeout:
+                self.stats['unackedCommands'] += 1
+                self.pendingAcks.pop(c)
 
     # commands are dicts with fields separated out -- just as if parsed
     def createCommand(self, desiredState):
@@ -458,7 +648,7 @@ class PentairProtocol:
         return cmd
 
     def createFrame(self, command):
-        frame = self.RECORD_SEPARATOR + self.START_BYTE + self.RECORD_SEPARATOR
+        frame = self.RECORD_SEPARATOR + bytes([self.START_BYTE]) + self.RECORD_SEPARATOR
 
         try:
             frame  = b''.join(list(map( lambda x: x.to_bytes(1, 'big'),[    
@@ -473,7 +663,9 @@ class PentairProtocol:
             check = self.checkSum(frame)
 
             frame = self.RECORD_SEPARATOR + frame + check.to_bytes(2, 'big') + self.RECORD_SEPARATOR
-        
+
+            self.pendingAcks[command['command']] = time.monotonic()
+
         except Exception as e:
             pass
 
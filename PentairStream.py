@@ -21,47 +21,404 @@ class MessageParser(Observer):
             self.messages.append(stream.split(self.separator))
 
 
+# takes a stream on #update and writes whole frames to the messages object
+#
+#   Unlike MessageParser, the stream is not split on a separator. Each chunk is scanned for
+#   START_BYTE and the header, and the declared payloadLength says where the frame ends. A frame
+#   that straddles two reads is carried over and completed on the next update -- so frames are exact
+#   (no IDLE_BYTE padding) and nothing is lost at read boundaries.
+#
+#   Frames are memoryviews into the chunk, not copies. A chunk that is not bytes is copied once so
+#   the views can never change underneath whoever holds them. A partial frame is kept in a reusable
+#   bytearray, and completed from the start of the next chunk -- only the frames finished there are
+#   copies, the chunk is never joined onto the carry.
+#
+#   Each frame's checksum is checked before its span is consumed -- a length byte is only trusted
+#   once the frame it declares adds up. A frame that fails is not skipped whole: scanning resumes at
+#   the next START_BYTE candidate inside it, so a good frame behind line noise (or a stray
+#   START_BYTE with a big length) is not lost. Nor does a candidate that is not complete yet hold up
+#   a good frame that already is, behind it. Each corrupted span counts once as a badFrame, and then
+#   as either salvagedFrames (per good frame found inside it) or lostFrames (nothing found). Without
+#   a protocol a private one keeps these stats.
+#
+class StreamDeframer(Observer):
+    # START_BYTE, the rest of the header, the most a length byte can declare and the checksum
+    MAX_FRAME_LENGTH = PentairProtocol.HEADER_LENGTH + 0xFF + PentairProtocol.CHECKSUM_LENGTH
+
+    def __init__(self, messages=None, protocol=None):
+        super().__init__()
+        self.messages = messages
+        self.protocol = PentairProtocol() if protocol is None else protocol
+
+        # bytes from the end of the last chunk that may be the start of a frame -- reused
+        self.carry = bytearray()
+        self.pos = 0
+
+        # end of the corrupted span being salvaged, relative to the start of the carry
+        self.salvageEnd = 0
+        self.salvaged = 0
+
+    def update(self, stream):
+        self.messages.append(self.deframe(stream))
+
+    def reset(self):
+        self.carry.clear()
+        self.salvageEnd = 0
+        self.salvaged = 0
+
+    def openSalvage(self, end):
+        stats = self.protocol.getStats()
+        stats['frameCount'] += 1
+        stats['badFrames'] += 1
+
+        self.salvageEnd = end
+        self.salvaged = 0
+
+    def closeSalvage(self):
+        if self.salvageEnd > 0 and self.salvaged == 0:
+            self.protocol.getStats()['lostFrames'] += 1
+
+        self.salvageEnd = 0
+
+    # True if a frame with a good checksum is complete in data[start + 1:n]
+    def frameAfter(self, data, start, n):
+        s = data.find(PentairProtocol.START_BYTE, start + 1)
+        while 0 <= s and s + PentairProtocol.HEADER_LENGTH <= n:
+            e = s + PentairProtocol.HEADER_LENGTH + data[s + PentairProtocol.LENGTH_OFFSET] + \
+                    PentairProtocol.CHECKSUM_LENGTH
+            if e <= n and self.protocol.validChecksum(data, s, e):
+                return True
+            s = data.find(PentairProtocol.START_BYTE, s + 1)
+
+        return False
+
+    def deframe(self, chunk):
+        return list(self.frames(chunk))
+
+    # generates the frames completed by chunk -- must be run to the end, that is when the partial frame
+    # is carried over
+    def frames(self, chunk):
+        carried = len(self.carry)
+        pos = 0
+
+        if carried > 0:
+            # complete the partial frame with no more of the chunk than a frame can take -- the rest of
+            # the chunk is still scanned in place
+            self.carry += chunk[:self.MAX_FRAME_LENGTH]
+            for start, end in self.spans(self.carry, 0, carried, 0):
+                # a copy, the carry is reused
+                yield bytes(self.carry[start:end])
+
+            if self.pos < carried:
+                # still not complete -- the whole chunk went into the carry
+                self.moveSalvage(self.pos)
+                del self.carry[:self.pos]
+                return
+
+            pos = self.pos - carried
+            self.carry.clear()
+
+        data = chunk if isinstance(chunk, bytes) else bytes(chunk)
+        view = memoryview(data)
+        for start, end in self.spans(data, pos, len(data), carried):
+            yield view[start:end]
+
+        # keep only the partial frame (if any) for the next read
+        self.moveSalvage(carried + self.pos)
+        self.carry += view[self.pos:]
+
+    # the (start, end) of the good frames in data[:n] that start before limit, scanning from pos --
+    # offset is where data begins relative to the carry (for the salvage span). Leaves self.pos where
+    # the scan stopped.
+    def spans(self, data, pos, limit, offset, n=None):
+        spans = []
+        if n is None:
+            n = len(data)
+        while True:
+            start = data.find(PentairProtocol.START_BYTE, pos, limit)
+            if start < 0:
+                # nothing but idle bytes and noise left (the last frame may have ended past limit)
+                pos = max(pos, limit)
+                break
+
+            if start + PentairProtocol.HEADER_LENGTH > n:
+                pos = start
+                break
+
+            end = start + PentairProtocol.HEADER_LENGTH + data[start + PentairProtocol.LENGTH_OFFSET] + \
+                    PentairProtocol.CHECKSUM_LENGTH
+            if end > n:
+                # a START_BYTE in noise can declare up to 255 bytes and hold back everything behind it
+                # -- if a good frame is already complete in there, this was not one
+                if not self.frameAfter(data, start, n):
+                    pos = start
+                    break
+
+                if start + offset >= self.salvageEnd:
+                    self.closeSalvage()
+                    self.openSalvage(end + offset)
+                pos = start + 1
+                continue
+
+            # (PentairProtocol.validChecksum, inline)
+            if ((data[end - 2] << 8) + data[end - 1]) != sum(data[start:end - 2]):
+                if start + offset >= self.salvageEnd:
+                    self.closeSalvage()
+                    self.openSalvage(end + offset)
+
+                # resync on the next START_BYTE candidate inside the bad frame
+                pos = start + 1
+                continue
+
+            if self.salvageEnd > 0:
+                if start + offset < self.salvageEnd:
+                    self.salvaged += 1
+                    self.protocol.getStats()['salvagedFrames'] += 1
+                else:
+                    self.closeSalvage()
+
+            spans.append((start, end))
+            pos = end
+
+        self.pos = pos
+        return spans
+
+    # the carry will start at pos (relative to where it started) -- moves the salvage span along
+    def moveSalvage(self, pos):
+        if self.salvageEnd > 0:
+            if pos >= self.salvageEnd:
+                self.closeSalvage()
+            else:
+                self.salvageEnd -= pos
+
+
+# takes a stream of whole frames back to back on #update -- frames already cut out and checked, e.g. by
+# BusReader's own StreamDeframer -- and writes them to the messages object
+#
+#   The frames are only cut apart on their length bytes: nothing is looked for or checked again, so
+#   parse them with PentairProtocol.decodeFrame. They are counted in the protocol's frameCount here,
+#   as parseFrame would have. Frames are memoryviews into the chunk, as from StreamDeframer.
+#
+class FrameSplitter(Observer):
+    def __init__(self, messages=None, protocol=None):
+        super().__init__()
+        self.messages = messages
+        self.protocol = PentairProtocol() if protocol is None else protocol
+
+    def update(self, stream):
+        self.messages.append(self.frames(stream))
+
+    def frames(self, chunk):
+        data = memoryview(chunk if isinstance(chunk, bytes) else bytes(chunk))
+        frames = []
+        pos = 0
+        n = len(data)
+        while pos + PentairProtocol.HEADER_LENGTH <= n:
+            end = pos + PentairProtocol.HEADER_LENGTH + data[pos + PentairProtocol.LENGTH_OFFSET] + \
+                    PentairProtocol.CHECKSUM_LENGTH
+            if end > n:
+                break
+            frames.append(data[pos:end])
+            pos = end
+
+        self.protocol.getStats()['frameCount'] += len(frames)
+        return frames
+
+
 # takes messsages and parses to frames
+#
+#   set padded=False when the messages are exact frames (e.g. from StreamDeframer)
 class FrameParser(Observer):
-    def __init__(self, frames):
+    def __init__(self, frames, padded=True):
         super().__init__()
         self.protocol = PentairProtocol()
+        self.padded = padded
 
         self.frames = frames
 
+    # invalid frames are counted by the protocol and dropped here
     def update(self, messages):
-        self.frames.append(list(map(self.protocol.parseFrame, messages)))
+        frames = []
+        for m in messages:
+            f = self.protocol.parseFrame(m, self.padded)
+            if f is not None:
+                frames.append(f)
+
+        self.frames.append(frames)
+
+    # observers of frames can say which state keys they use with a keys attribute (None, or no
+    # attribute, for all of them)
+    def addFrameObserver(self, observer):
+        self.frames.addObserver(observer)
+        self.protocol.addConsumer(getattr(observer, 'keys', None))
 
+# merges the state of each frame into state
+#
+#   keys are the state keys wanted (None for all) -- the protocol only decodes what its consumers want
 class StateAggregator(Observer):
-    def __init__(self, state):
+    def __init__(self, state, keys=None):
         super().__init__()
         self.state = state
+        self.keys = keys
 
+    # unchanged frames would merge the same values again -- skip them
     def update(self, parsedFrames):
         for p in parsedFrames:
-            if 'state' in p:
-                self.state.append(p['state'])
+            if not p.unchanged:
+                self.state.append(p.state)
+
+# deframes, validates, decodes and merges each chunk into state in one loop -- instead of passing lists
+# from StreamDeframer to FrameParser to StateAggregator
+#
+#   state (an ObservableDict or StateStore) is notified once per chunk, if anything in it changed. Observers that need the frames
+#   themselves (e.g. CSV output) can still be added with addFrameObserver -- only then are the
+#   frames of a chunk collected into a list for them.
+#
+#   exact=True when the chunks are whole frames that were already checked (BusReader) -- they are
+#   split with FrameSplitter and decoded without deframing or checking them again.
+#
+class FusedPipeline(Observer):
+    def __init__(self, state, protocol=None, keys=None, exact=False):
+        super().__init__()
+        self.state = state
+        self.protocol = PentairProtocol() if protocol is None else protocol
+        self.exact = exact
+        if exact:
+            self.deframer = FrameSplitter(protocol=self.protocol)
+        else:
+            self.deframer = StreamDeframer(protocol=self.protocol)
+
+        self.frames = ObservableArray()
+        self.protocol.addConsumer(keys)
 
+    def addFrameObserver(self, observer):
+        self.frames.addObserver(observer)
+        self.protocol.addConsumer(getattr(observer, 'keys', None))
+
+    def update(self, chunk):
+        merge = self.state.merge
+        changed = False
+        frames = [] if len(self.frames.observers) > 0 else None
+
+        if self.exact:
+            decodeFrame = self.protocol.decodeFrame
+            parsed = [decodeFrame(f) for f in self.deframer.frames(chunk)]
+        else:
+            parseFrame = self.protocol.parseFrame
+            parsed = [parseFrame(f, False) for f in self.deframer.frames(chunk)]
+
+        for frame in parsed:
+            if frame is None:
+                continue
+
+            if not frame.unchanged and len(frame.state) > 0 and merge(frame.state):
+                changed = True
+
+            if frames is not None:
+                frames.append(frame)
+
+        if changed:
+            self.state.notifyChanged()
+
+        if frames is not None:
+            self.frames.append(frames)
+
+
+# passes each frame on only to the observers that subscribed to a pattern matching it
+#
+#   A pattern is (type, destination, source, command), any of them None to match anything -- e.g.
+#   (None, None, 0x60, None) for everything from the pump. Which observers a given header goes to is
+#   worked out the first time it is seen and kept in a dict, so a frame costs one lookup plus its own
+#   subscribers, however many observers there are in all. Each observer gets its frames of a batch in
+#   one update().
+#
+#   With a protocol, subscribing also registers the observer's state keys (see addFrameObserver).
+#
+class FrameRouter(Observer):
+    # headers to remember the subscribers of before starting over (noise can pass a checksum)
+    MAX_ROUTES = 1024
+
+    def __init__(self, protocol=None):
+        super().__init__()
+        self.protocol = protocol
+        # the router itself needs no state
+        self.keys = ()
+
+        self.subscriptions = []
+        # (type, destination, source, command) -> observers
+        self.routes = {}
+
+    def subscribe(self, observer, commandType=None, destination=None, source=None, command=None):
+        self.subscriptions.append(((commandType, destination, source, command), observer))
+        self.routes.clear()
+
+        if self.protocol is not None:
+            self.protocol.addConsumer(getattr(observer, 'keys', None))
+
+    def unsubscribe(self, observer):
+        self.subscriptions = [(p, o) for p, o in self.subscriptions if o is not observer]
+        self.routes.clear()
+
+    def match(self, header):
+        observers = []
+        for pattern, o in self.subscriptions:
+            if all(p is None or p == h for p, h in zip(pattern, header)) and o not in observers:
+                observers.append(o)
+
+        if len(self.routes) >= self.MAX_ROUTES:
+            self.routes.clear()
+        self.routes[header] = tuple(observers)
+
+        return self.routes[header]
+
+    def update(self, frames):
+        batches = {}
+        for f in frames:
+            # a Frame starts with type, destination, source, command
+            header = f[:4]
+            observers = self.routes.get(header)
+            if observers is None:
+                observers = self.match(header)
+
+            for o in observers:
+                batch = batches.get(o)
+                if batch is None:
+                    batches[o] = [f]
+                else:
+                    batch.append(f)
+
+        for o, batch in batches.items():
+            o.update(batch)
+
+
+#   keys limits the state to these keys (None for all)
+#   fused uses a FusedPipeline instead of the chain of observers
 class PentairStream:
-    def __init__(self, connection):
+    def __init__(self, connection, keys=None, fused=False):
         self.connection = connection
 
         self.streamData = ObservableString()
+        self.state = ObservableDict()
+
+        if fused:
+            self.pipeline = FusedPipeline(self.state, keys=keys)
+            self.streamData.addObserver(self.pipeline)
+            self.frames = self.pipeline.frames
+            return
+
         self.messages = ObservableArray()
         self.frames = ObservableArray()
-        self.state = ObservableDict()
 
-        # messageParser will chop the stream into separate messages
-        self.messageParser = MessageParser(PentairProtocol.RECORD_SEPARATOR, self.messages)
+        self.frameParser = FrameParser(self.frames, padded=False)
+        self.messages.addObserver(self.frameParser)
+
+        # messageParser will chop the stream into whole frames, carrying partials between reads
+        self.messageParser = StreamDeframer(self.messages, self.frameParser.protocol)
         # connect messageParser as an oberver of streamData
         self.streamData.addObserver(self.messageParser)
 
-        self.frameParser = FrameParser(self.frames)
-        self.messages.addObserver(self.frameParser)
-
-        self.state = ObservableDict()
-        self.stateAggregator = StateAggregator(self.state)
-        self.frames.addObserver(self.stateAggregator)
+        self.stateAggregator = StateAggregator(self.state, keys)
+        self.frameParser.addFrameObserver(self.stateAggregator)
 
     def getState(self):
         self.streamData.append(self.connection.listen())
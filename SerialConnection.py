@@ -29,6 +29,7 @@ class SerialConnection(IOConnection):
 
     def listen(self):
         # events = []
+        self.readbuffer = b''
         n = self.ser.inWaiting()
         if n > 0:
             try:
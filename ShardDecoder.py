@@ -0,0 +1,182 @@
+# ShardDecoder
+#
+#   Decodes a raw stream or timestamped capture file in shards, so the shards can go to a pool of
+#   processes -- see pentair-decode.py.
+#
+#   A shard nominally covers [start, end) of the file (byte offsets of a raw stream, record offsets
+#   of a capture). It is cut where a RECORD_SEPARATOR followed by START_BYTE begins at or after start,
+#   and runs up to the same kind of cut at or after end -- so the shards tile the stream exactly, and
+#   each one usually starts where the deframer would be between frames anyway.
+#
+#   Usually, not always: a corrupted length byte can make a frame (or a salvage
+#   span) run across a cut. A shard's result says where its deframer was left (carry, salvage state);
+#   if that is not fresh, the next shard has to be decoded again starting from there, e.g.
+#
+#       results = pool.imap(decodeShard, jobs)
+#       ...
+#       if not inSync(previous):
+#           result = decodeShard(job, previous)
+#
+#   Each shard decodes with its own PentairProtocol, so its result only holds what does not depend
+#   on earlier shards: the frames as CSV lines (like pentair-control.py --csv), the stats, and the
+#   state changes of each frame relative to earlier frames *of the same shard*. The first time a
+#   shard sees a key always counts as a change -- whoever merges the shards in order drops the ones
+#   that are not changes after all.
+#
+
+import json
+import mmap
+import os
+
+from BatchDecoder import BatchDecoder
+from CaptureFile import CaptureReader, HEADER, isCapture
+from PentairProtocol import PentairProtocol
+
+
+CUT = PentairProtocol.RECORD_SEPARATOR + bytes([PentairProtocol.START_BYTE])
+
+# bytes per piece when reading on past the end of a raw shard to find its cut
+PIECE_SIZE = 65536
+
+
+class RawSource:
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(filename) > 0 else b''
+
+    # (start, end) of shards of about size bytes -- end None for the last
+    def shards(self, size):
+        starts = list(range(0, len(self.map), size)) or [0]
+        return list(zip(starts, starts[1:] + [None]))
+
+    def pieces(self, start, end):
+        if end is not None:
+            yield self.map[start:end]
+            return
+
+        for offset in range(start, len(self.map), PIECE_SIZE):
+            yield self.map[offset:offset + PIECE_SIZE]
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+
+# shards start on indexed records -- without an index the capture is a single shard
+class CaptureSource:
+    def __init__(self, filename):
+        self.reader = CaptureReader(filename)
+
+    def shards(self, size):
+        starts = [HEADER.size]
+        for offset in self.reader.offsets:
+            if offset >= starts[-1] + size:
+                starts.append(offset)
+
+        return list(zip(starts, starts[1:] + [None]))
+
+    def pieces(self, start, end):
+        reader = self.reader
+        reader.offset = start
+
+        record = reader.peek()
+        while record is not None and (end is None or reader.offset < end):
+            yield reader.map[record[1]:record[2]]
+
+            reader.advance()
+            record = reader.peek()
+
+    def close(self):
+        self.reader.close()
+
+
+def openSource(filename):
+    return CaptureSource(filename) if isCapture(filename) else RawSource(filename)
+
+
+# the stream bytes of a shard, from its cut to the next one
+def shardStream(source, start, end, first):
+    head = b''.join(source.pieces(start, end))
+
+    skip = 0
+    if not first:
+        skip = head.find(CUT)
+        if skip < 0:
+            # the previous shard runs on through all of this one
+            return b''
+
+    if end is None:
+        return head[skip:]
+
+    tail = bytearray()
+    for piece in source.pieces(end, None):
+        searchFrom = max(0, len(tail) - len(CUT) + 1)
+        tail += piece
+
+        cut = tail.find(CUT, searchFrom)
+        if cut >= 0:
+            return head[skip:] + tail[:cut]
+
+    return head[skip:] + tail
+
+
+def csvLine(f):
+    return f'{f.type:02X},{f.destination:02X},{f.source:02X},{f.command:02X},{f.payloadLength:02X},' + \
+           ' '.join(f'{b:02X}' for b in f.payload) + ',' + json.dumps(f.state) + '\n'
+
+
+# decodes the stream bytes of a shard a batch at a time (BatchDecoder) -- carry on from where previous
+# left the deframer, if given
+def decodeBytes(data, protocol, csv=True, previous=None):
+    decoder = BatchDecoder(protocol)
+    deframer = decoder.deframer
+    if previous is not None:
+        decoder.carry = previous['carry']
+        deframer.salvageEnd = previous['salvageEnd']
+        deframer.salvaged = previous['salvaged']
+
+    lines = []
+    changes = []
+    state = {}
+    count = 0
+
+    for frame in decoder.decodeChunk(data):
+        if csv:
+            lines.append(csvLine(frame))
+
+        changed = { k: v for k, v in frame.state.items() if k not in state or state[k] != v }
+        if len(changed) > 0:
+            state.update(changed)
+            changes.append((count, changed))
+
+        count += 1
+
+    stats = protocol.getStats()
+    protocol.resetStats()
+
+    return {    'frames': count,
+                'csv': ''.join(lines),
+                'changes': changes,
+                'stats': stats,
+                'carry': decoder.carry,
+                'salvageEnd': deframer.salvageEnd,
+                'salvaged': deframer.salvaged }
+
+
+# True if a shard left the deframer just as a fresh one would start the next shard
+def inSync(result):
+    return len(result['carry']) == 0 and result['salvageEnd'] == 0
+
+
+#   job -- (filename, start, end, first, csv)
+def decodeShard(job, previous=None):
+    filename, start, end, first, csv = job
+
+    source = openSource(filename)
+    try:
+        data = shardStream(source, start, end, first)
+    finally:
+        source.close()
+
+    return decodeBytes(data, PentairProtocol(), csv, previous)
@@ -0,0 +1,80 @@
+# StateStore
+#
+#   The accumulated pool state, for a fixed set of keys -- a drop-in for ObservableDict as the target
+#   of StateAggregator and FusedPipeline, that also keeps track of what changed.
+#
+#   Values and versions are kept in two lists indexed by key. Every merge that changes something
+#   bumps the store's version, and each changed key is stamped with it. A consumer remembers the
+#   version it last saw and asks for changedSince(it) -- no copying the whole state or diffing dicts.
+#
+#       changes, seen = store.changedSince(seen)
+#
+#   Keys outside the schema are ignored, so e.g. date keys decoded for --csv never reach the shadow.
+#
+#   One thread may merge while others read -- a reader may be handed a key again the next time
+#   round, but never misses one.
+#
+
+from Observer import Observable
+
+
+class StateStore(Observable):
+    def __init__(self, keys):
+        super().__init__()
+        self.keys = tuple(sorted(keys))
+        self.index = { k: i for i, k in enumerate(self.keys) }
+
+        self.values = [None] * len(self.keys)
+        # 0 -- never set
+        self.versions = [0] * len(self.keys)
+        self.version = 0
+
+    # merges newDict without notifying -- returns True if any value changed
+    def merge(self, newDict):
+        version = self.version + 1
+        changed = False
+
+        for k, v in newDict.items():
+            i = self.index.get(k)
+            if i is None:
+                continue
+
+            if self.versions[i] == 0 or self.values[i] != v:
+                self.values[i] = v
+                self.versions[i] = version
+                changed = True
+
+        if changed:
+            self.version = version
+
+        return changed
+
+    # ObservableDict compatible -- merges and notifies if anything changed
+    def append(self, newDict):
+        if self.merge(newDict):
+            self.notifyObservers(self)
+
+    def notifyChanged(self):
+        self.notifyObservers(self)
+
+    def get(self, key, default=None):
+        i = self.index.get(key)
+        if i is None or self.versions[i] == 0:
+            return default
+        return self.values[i]
+
+    def versionOf(self, key):
+        return self.versions[self.index[key]]
+
+    # (the keys changed after version, as a dict -- the version to ask with next time)
+    def changedSince(self, version):
+        # read first -- anything merged while collecting is newer and comes round again next time
+        current = self.version
+        versions = self.versions
+        values = self.values
+
+        return ({ k: values[i] for i, k in enumerate(self.keys) if versions[i] > version }, current)
+
+    # a new dict of every key that has been set
+    def getDict(self):
+        return self.changedSince(0)[0]
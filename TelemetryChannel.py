@@ -0,0 +1,117 @@
+# TelemetryChannel
+#
+#   Time series for keys that change too often for the shadow (temperatures, pump power ...).
+#
+#   Each key is sampled from the state at its own interval into a pair of arrays (timestamps, values).
+#   Every publishInterval the samples are sent as one message and the arrays start over, e.g.
+#
+#       { "ts": 1700000000.0,
+#         "pumpWatts": { "t": [0, 1000, 2000 ...], "v": [785, 788, 786 ...] },
+#         "waterTemp": { "t": [0, 60000], "v": [82, 82] } }
+#
+#   ts is the time of the first sample (epoch seconds), t the milliseconds after it. Messages are
+#   JSON, or whatever the given MessageEncoder makes of them.
+#
+#   sample() and publish() may be called from different threads.
+#
+
+from array import array
+import threading
+import time
+
+from MessageEncoder import JSONMessageEncoder
+
+
+class TelemetryChannel:
+    # seconds between messages
+    PUBLISH_INTERVAL = 60
+
+    #   intervals -- key -> seconds between samples
+    def __init__(self, connection, topic, state, intervals, publishInterval=PUBLISH_INTERVAL, encoder=None):
+        self.connection = connection
+        self.encoder = JSONMessageEncoder() if encoder is None else encoder
+        self.topic = topic
+        self.state = state
+        self.intervals = intervals
+        self.publishInterval = publishInterval
+
+        self.lock = threading.Lock()
+        self.due = { k: 0 for k in intervals }
+        self.clear()
+        self.lastPublish = time.monotonic()
+
+        self.stats = { 'telemetrySamples': 0, 'telemetryMessages': 0 }
+
+    def clear(self):
+        self.times = { k: array('d') for k in self.intervals }
+        self.values = { k: array('d') for k in self.intervals }
+
+    def keys(self):
+        return self.intervals.keys()
+
+    # seconds until the next sample is due
+    def untilDue(self):
+        return max(0, min(self.due.values(), default=time.monotonic() + self.publishInterval) - time.monotonic())
+
+    # samples the keys that are due -- keys not decoded yet (or not numbers) are skipped
+    def sample(self):
+        now = time.monotonic()
+        t = None
+
+        with self.lock:
+            for k, interval in self.intervals.items():
+                if now < self.due[k]:
+                    continue
+                # on the interval grid, unless a whole interval was missed
+                self.due[k] += interval
+                if self.due[k] <= now:
+                    self.due[k] = now + interval
+
+                v = self.state.get(k)
+                if not isinstance(v, (int, float)):
+                    continue
+
+                if t is None:
+                    t = time.time()
+                self.times[k].append(t)
+                self.values[k].append(v)
+                self.stats['telemetrySamples'] += 1
+
+    def publishDue(self):
+        return time.monotonic() - self.lastPublish >= self.publishInterval
+
+    # returns the samples so far as a message, and starts over
+    def takeMessage(self):
+        with self.lock:
+            times = self.times
+            values = self.values
+            self.clear()
+            self.lastPublish = time.monotonic()
+
+        if all(len(t) == 0 for t in times.values()):
+            return None
+
+        ts = min(t[0] for t in times.values() if len(t) > 0)
+        message = { 'ts': ts }
+        for k in self.intervals:
+            if len(times[k]) > 0:
+                message[k] = {  't': [round((t - ts) * 1000) for t in times[k]],
+                                'v': [int(v) if v.is_integer() else v for v in values[k]] }
+
+        return message
+
+    def publish(self):
+        message = self.takeMessage()
+        if message is None:
+            return
+
+        self.connection.publishMessageOnTopic(self.encoder.encode(message), self.topic)
+        self.stats['telemetryMessages'] += 1
+
+    # returns the counters for this period and starts the next one
+    def takeStats(self):
+        with self.lock:
+            stats = self.stats
+            self.stats = { 'telemetrySamples': 0, 'telemetryMessages': 0 }
+
+        return stats
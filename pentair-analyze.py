@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+#
+# pentair-analyze.py
+#
+#   Helps work out messages nothing decodes yet.  Reads a raw or timestamped capture in one streaming
+#   pass and prints, for each (type, src, dst, command, length) no payload decoder knows, what every
+#   byte of the payload does: constant, counter, correlated with a known state key, or how much it
+#   changes and which bits flip.  Memory stays flat, so multi-GB captures are fine.
+#
+#       ./pentair-analyze.py -i capture.bin
+#       ./pentair-analyze.py -i capture.cap --from 3600 --to 7200 --known
+#
+#   Needs numpy.
+#
+from BatchDecoder import BatchDecoder
+from FileReader import FileReader
+from FrameAnalyzer import FrameAnalyzer
+from PentairProtocol import PentairProtocol
+
+import argparse
+import json
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--inputfile", action="store", required=True, dest="inFile", help="raw protocol stream or timestamped capture to analyze")
+parser.add_argument("--chunk", action="store", type=int, dest="chunkSize", default=1 << 20, help="bytes per read from the input file")
+parser.add_argument("--from", action="store", type=float, dest="fromTime", default=0, help="start this many seconds after a timestamped capture began")
+parser.add_argument("--to", action="store", type=float, dest="toTime", default=None, help="stop this many seconds after a timestamped capture began")
+parser.add_argument("--known", action="store_true", help="analyze frames that already decode too")
+parser.add_argument("--batch", action="store", type=int, dest="batch", default=4096, help="payloads collected per message before updating its statistics")
+parser.add_argument("--min-frames", action="store", type=int, dest="minFrames", default=2, help="leave messages seen fewer times than this out of the report")
+parser.add_argument("--threshold", action="store", type=float, dest="threshold", default=0.9, help="report a byte as correlated with a state key from this |r|")
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    protocol = PentairProtocol()
+    analyzer = FrameAnalyzer(protocol, args.batch, args.known)
+
+    # each read is checked a batch at a time, decoding only the keys the analyzer correlates against
+    protocol.addConsumer(analyzer.keys)
+    decoder = BatchDecoder(protocol)
+
+    reader = FileReader(args.inFile, args.chunkSize, 0, args.fromTime, args.toTime)
+    reader.open()
+
+    while True:
+        chunk = reader.listen()
+        if len(chunk) == 0:
+            break
+        analyzer.update(decoder.decodeChunk(chunk))
+
+    print(analyzer.report(args.minFrames, args.threshold))
+    print(json.dumps(protocol.getStats()))
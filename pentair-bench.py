@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+#
+# pentair-bench.py
+#
+#   Benchmarks the decode and command hot paths on synthetic bus traffic from EasyTouchSimulator.
+#
+#   For each frame mix and stage: frames/sec, per-call latency percentiles and allocation per frame.
+#   Allocation is measured in a separate, slower pass with tracemalloc -- allocBytesPerFrame is the
+#   mean transient peak while handling one call, retainedBlocksPerFrame the blocks still alive after.
+#   Results are written as JSON; --compare prints the change against an earlier results file.
+#
+#       ./pentair-bench.py --output bench-new.json --compare bench-old.json
+#
+from BatchDecoder import BatchDecoder, frameSpans, validMask
+from EasyTouchSimulator import EasyTouchSimulator
+from Observer import ObservableArray, ObservableDict, Observer
+from PentairProtocol import PAYLOADS, PentairProtocol
+from PentairStream import FrameRouter, MessageParser, PentairStream, StateAggregator, StreamDeframer
+
+import argparse
+from datetime import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+# relative frequency of each broadcast in a mix -- 'realistic' follows the controller's schedule
+MIXES = {   'realistic': { 'status': 1 / 2.0, 'date': 1 / 2.0, 'temp': 1 / 10.0, 'pump': 1 / 5.0 },
+            'status': { 'status': 1 },
+            'pump': { 'pump': 1 },
+            'noisy': { 'status': 1 / 2.0, 'date': 1 / 2.0, 'temp': 1 / 10.0, 'pump': 1 / 5.0 } }
+NOISE = { 'noisy': 0.05 }
+
+
+def makeStream(mix, count, seed):
+    simulator = EasyTouchSimulator(noise=NOISE.get(mix, 0.0), seed=seed)
+    chooser = random.Random(seed)
+    names = list(MIXES[mix].keys())
+    weights = list(MIXES[mix].values())
+
+    frames = []
+    for i in range(count):
+        simulator.wander()
+        frames.append(simulator.inject(getattr(simulator, chooser.choices(names, weights)[0] + 'Frame')()))
+
+    return b''.join(frames)
+
+def chunks(stream, size):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+# replays chunks through listen() for the full PentairStream path
+class ChunkConnection:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.i = 0
+
+    def listen(self):
+        chunk = self.chunks[self.i % len(self.chunks)]
+        self.i += 1
+        return chunk
+
+
+#
+# stages -- each returns (callable, inputs, frames per pass over the inputs)
+#
+def stages(stream, chunkSize):
+    protocol = PentairProtocol()
+    exact = StreamDeframer().deframe(stream)
+    valid = [f for f in exact if protocol.validFrame(f, padded=False)]
+    parsed = [protocol.parseFrame(f, padded=False) for f in valid]
+    reads = chunks(stream, chunkSize)
+
+    s = {}
+    s['checkSum'] = (protocol.checkSum, [f[:-2] for f in valid], len(valid))
+    s['validFrame'] = (lambda f: protocol.validFrame(f, padded=False), exact, len(exact))
+    s['parseFrame'] = (lambda f: protocol.parseFrame(f, padded=False), valid, len(valid))
+
+    for (t, c), decode in protocol.decoders.items():
+        bodies = [p.payload for p in parsed if p.type == t and p.command == c]
+        if len(bodies) > 0:
+            s['payload.' + PAYLOADS.name(t, c)] = (decode, bodies, len(bodies))
+
+    # the same payloads through parsePayload and its cache (see payload.* for the decode alone)
+    parse = lambda p: protocol.parsePayload(p.type, p.command, p.payload)
+    for t, c in protocol.caches.keys():
+        frames = [p for p in parsed if p.type == t and p.command == c]
+        if len(frames) > 0:
+            s['parsePayload.' + PAYLOADS.name(t, c)] = (parse, frames, len(frames))
+    s['parsePayload'] = (parse, parsed, len(parsed))
+
+    # stream stages are called per read, so their latencies are per read too
+    s['MessageParser'] = (MessageParser(PentairProtocol.RECORD_SEPARATOR, ObservableArray()).update, reads, len(exact))
+    s['StreamDeframer'] = (StreamDeframer(ObservableArray()).update, reads, len(exact))
+
+    # batch stages take the whole stream in one call
+    offsets, lengths, end = frameSpans(stream)
+    s['validMask'] = (lambda b: validMask(b, offsets, lengths), [stream], len(exact))
+    s['BatchDecoder'] = (BatchDecoder().decode, [stream], len(exact))
+
+    aggregator = StateAggregator(ObservableDict())
+    s['StateAggregator'] = (lambda p: aggregator.update([p]), parsed, len(parsed))
+
+    # a pump-only and a status-only consumer among others that never match
+    router = FrameRouter()
+    router.subscribe(Observer(), source=0x60)
+    router.subscribe(Observer(), 0x24, command=0x02)
+    for c in range(0x80, 0x88):
+        router.subscribe(Observer(), 0x24, command=c)
+    s['FrameRouter'] = (lambda p: router.update([p]), parsed, len(parsed))
+
+    states = [{ 'spa': True }, { 'pool': False }, { 'aux1': True }, { 'feature2': False }]
+    commands = [protocol.createCommand(d) for d in states]
+    s['createCommand'] = (protocol.createCommand, states, len(states))
+    s['createFrame'] = (protocol.createFrame, commands, len(commands))
+
+    pentairStream = PentairStream(ChunkConnection(reads))
+    s['PentairStream.getState'] = (lambda r: pentairStream.getState(), reads, len(exact))
+    fusedStream = PentairStream(ChunkConnection(reads), fused=True)
+    s['PentairStream.fused'] = (lambda r: fusedStream.getState(), reads, len(exact))
+
+    return s
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def measure(fn, inputs, frames, minTime):
+    # timing pass -- repeat over the inputs until minTime has passed
+    latencies = []
+    passes = 0
+    start = time.perf_counter()
+    while True:
+        for i in inputs:
+            t = time.perf_counter_ns()
+            fn(i)
+            latencies.append(time.perf_counter_ns() - t)
+
+        passes += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            break
+
+    latencies.sort()
+
+    # allocation pass -- one call at a time under tracemalloc
+    sample = inputs[:1000]
+    tracemalloc.start()
+    transient = 0
+    blocks = sys.getallocatedblocks()
+    for i in sample:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        fn(i)
+        transient += tracemalloc.get_traced_memory()[1] - current
+    retained = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    framesPerCall = frames / len(inputs)
+    return {    'framesPerSec': round(frames * passes / elapsed, 1),
+                'calls': len(latencies),
+                'latencyNs': {  'p50': percentile(latencies, 50),
+                                'p90': percentile(latencies, 90),
+                                'p99': percentile(latencies, 99),
+                                'max': latencies[-1] },
+                'allocBytesPerFrame': round(transient / len(sample) / framesPerCall, 1),
+                'retainedBlocksPerFrame': round(retained / len(sample) / framesPerCall, 3) }
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True).stdout.strip()
+    except Exception as err:
+        return ''
+
+def compare(results, baseline):
+    for mix, stageResults in results['mixes'].items():
+        for stage, r in stageResults.items():
+            try:
+                old = baseline['mixes'][mix][stage]['framesPerSec']
+                print(f"{mix:10} {stage:28} {r['framesPerSec']:>12.0f} frames/s  {r['framesPerSec'] / old:6.2f}x")
+            except KeyError as e:
+                print(f"{mix:10} {stage:28} {r['framesPerSec']:>12.0f} frames/s  (new)")
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--frames", action="store", type=int, dest="frames", default=5000, help="frames in each synthetic stream")
+parser.add_argument("--chunk", action="store", type=int, dest="chunkSize", default=64, help="bytes per read for the stream stages")
+parser.add_argument("--mix", action="append", dest="mixes", default=[], help=f"frame mix to run, repeatable (default all of {', '.join(MIXES)})")
+parser.add_argument("--stage", action="append", dest="stages", default=[], help="only run stages starting with this, repeatable")
+parser.add_argument("--time", action="store", type=float, dest="minTime", default=0.5, help="minimum seconds to time each stage")
+parser.add_argument("--seed", action="store", type=int, dest="seed", default=1, help="random seed for the synthetic streams")
+parser.add_argument("-o", "--output", action="store", dest="output", default="bench.json", help="results file")
+parser.add_argument("--compare", action="store", dest="compare", default="", help="earlier results file to compare against")
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    results = { 'version': version(),
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'frames': args.frames,
+                'chunk': args.chunkSize,
+                'mixes': {} }
+
+    for mix in (args.mixes or list(MIXES)):
+        stream = makeStream(mix, args.frames, args.seed)
+        results['mixes'][mix] = {}
+
+        for name, (fn, inputs, frames) in stages(stream, args.chunkSize).items():
+            if len(args.stages) > 0 and not any(name.startswith(s) for s in args.stages):
+                continue
+
+            r = measure(fn, inputs, frames, args.minTime)
+            results['mixes'][mix][name] = r
+            print(f"{mix:10} {name:28} {r['framesPerSec']:>12.0f} frames/s  p50 {r['latencyNs']['p50']:>8} ns  "
+                  f"p99 {r['latencyNs']['p99']:>8} ns  {r['allocBytesPerFrame']:>8} B/frame", flush=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if len(args.compare) > 0:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -1,16 +1,28 @@
 #!/usr/bin/python3
 from collections.abc import Iterable
 from distutils.util import strtobool
+from AsyncSerialConnection import AsyncSerialConnection
+from BusReader import BusReader
+from CaptureFile import CaptureRecorder
 from FileReader import FileReader
+from FlightRecorder import FlightRecorder
+from MessageEncoder import ENCODERS
 from GreengrassAwareConnection import *
 from Observer import *
-from PentairProtocol import PentairProtocol
+from PentairProtocol import PAYLOADS, PentairProtocol
+from PentairStream import FrameRouter, FrameSplitter, FusedPipeline, StreamDeframer
 from SerialConnection import SerialConnection
+from StateStore import StateStore
+from TelemetryChannel import TelemetryChannel
 
 import argparse
+import asyncio
 from datetime import datetime
 import json
 import logging
+import signal
+import sys
+import threading
 import time
 
 
@@ -30,57 +42,81 @@ class MessageParser(Observer):
 
 
 # takes messsages and parses to frames
+#
+#   set padded=False when the messages are exact frames (e.g. from StreamDeframer), and checked=True
+#   when they were checked and counted already too (FrameSplitter)
 class FrameParser(Observer):
-    def __init__(self, frames, protocol):
+    def __init__(self, frames, protocol, padded=True, checked=False):
         super().__init__()
         self.protocol = protocol
+        self.padded = padded
+        self.checked = checked
 
         self.frames = frames
 
+    # invalid frames are counted by the protocol and dropped here
     def update(self, messages):
-        self.frames.append(list(map(self.protocol.parseFrame, messages)))
+        if self.checked:
+            self.frames.append([self.protocol.decodeFrame(m) for m in messages])
+            return
+
+        frames = []
+        for m in messages:
+            f = self.protocol.parseFrame(m, self.padded)
+            if f is not None:
+                frames.append(f)
+
+        self.frames.append(frames)
 
+    # observers of frames can say which state keys they use with a keys attribute (None, or no
+    # attribute, for all of them)
+    def addFrameObserver(self, observer):
+        self.frames.addObserver(observer)
+        self.protocol.addConsumer(getattr(observer, 'keys', None))
 
+
+# merges the state of each frame into state
+#
+#   keys are the state keys wanted (None for all) -- the protocol only decodes what its consumers want
 class StateAggregator(Observer):
-    def __init__(self, state):
+    def __init__(self, state, keys=None):
         super().__init__()
         self.state = state
+        self.keys = keys
 
+    # unchanged frames would merge the same values again -- skip them
     def update(self, parsedFrames):
         for p in parsedFrames:
-            if 'state' in p:
-                self.state.append(p['state'])
+            if not p.unchanged:
+                self.state.append(p.state)
 
 class MQTTPublisher(Observer):
-    def __init__(self, client, topic):
+    def __init__(self, client, topic, encoder):
         super().__init__()
         self.client = client
         self.topicBase = topic
+        self.encoder = encoder
+        # raw payloads only
+        self.keys = ()
 
     def update(self, parsedFrames):
         for p in parsedFrames:
-            try:
-                topic = self.topicBase + '/' + \
-                    "/".join((str(p['type']), str(p['destination']), str(p['source']), str(p['command'])))
-                message = " ".join(f'{b:02X}' for b in p['payload'])
-                self.client.publishMessageOnTopic(message, topic)
-            except KeyError as e:
-                pass
+            topic = f'{self.topicBase}/{p.type}/{p.destination}/{p.source}/{p.command}'
+            message = self.encoder.encodePayload(p.payload)
+            self.client.publishMessageOnTopic(message, topic)
 
 class CSVOutput(Observer):
     def __init__(self):
         super().__init__()
+        self.keys = None
 
-    def update(self, objects):
-        for o in objects:
-            if len(o) > 0:
-                try:
-                    s = ''
-                    if 'state' in o:
-                        s = o.pop('state')
-                    print( ",".join(list(map((lambda x: f'{x:02X}' if not isinstance(x, Iterable) else ' '.join(f'{b:02X}' for b in x) if len(x) > 0  else ''), list(o.values())))) + "," + json.dumps(s) )
-                except Exception as err:
-                    print(err)
+    def update(self, frames):
+        for f in frames:
+            try:
+                print(f'{f.type:02X},{f.destination:02X},{f.source:02X},{f.command:02X},{f.payloadLength:02X},' +
+                      ' '.join(f'{b:02X}' for b in f.payload) + "," + json.dumps(f.state))
+            except Exception as err:
+                print(err)
 
 class DeltaCommandProcessor(Observer):
     def __init__(self, commands, protocol):
@@ -114,9 +150,21 @@ class OutputWriter(Observer):
         if len(messages) > 0:
             self.connection.send(messages)
             # force a state update -- needs a refactor
-            streamData.append(connection.listen())
+            #   (with --async the loop reads the answer as soon as it arrives anyway)
+            if not isinstance(self.connection, AsyncSerialConnection):
+                readConnection()
 
 
+# seconds to wait for the controller to ACK a command before counting it as unacked
+ACK_TIMEOUT = 5
+
+# the controller's clock -- not worth a shadow update
+DATE_KEYS = ['hour', 'min', 'dow', 'day', 'month', 'year', 'adjust', 'dst']
+
+# with --async, longest to go without offering the shadow an update when state isn't changing -- keys
+# held back by --min-interval may be due
+IDLE_PUBLISH_INTERVAL = 60
+
 # Configure logging
 logger = logging.getLogger("Pentair-Thing.core")
 logger.setLevel(logging.INFO)
@@ -139,10 +187,26 @@ parser.add_argument("-n", "--thingName", action="store", dest="thingName", defau
 #
 # file input args
 parser.add_argument("-i", "--inputfile", action="store", required=False, dest="inFile", default="", help="input file with raw protocol stream")
+parser.add_argument("--chunk", action="store", type=int, dest="chunkSize", default=0, help="mmap the input file and read at most this many bytes per tick (0 reads it all at once)")
+parser.add_argument("--speed", action="store", type=float, dest="speed", default=0, help="pace input file replay: 1 is real time at 9600 baud, 2 twice as fast, 0 as fast as possible")
+parser.add_argument("--from", action="store", type=float, dest="fromTime", default=0, help="replay a timestamped capture from this many seconds after recording began")
+parser.add_argument("--to", action="store", type=float, dest="toTime", default=None, help="stop replaying a timestamped capture at this many seconds after recording began")
 
 # serial port args
 parser.add_argument("-p", "--port", action="store", required=False, dest="port", default="/dev/ttyS0", help="Serial Port Device")
 parser.add_argument("-t", "--timeout", action="store", required=True, dest="timeout", default="0.5", help="Timeout to wait for events")
+parser.add_argument("--async", action="store_true", dest="useAsync", help="read the serial port as soon as data arrives (asyncio) and publish from its own coroutine")
+parser.add_argument("--thread", action="store_true", dest="useThread", help="drain the serial port and cut it into frames on its own thread, queued in a ring buffer so publishing never delays reads")
+parser.add_argument("--ring-bytes", action="store", type=int, dest="ringBytes", default=65536, help="with --thread, size of the ring buffer between the reader thread and processing")
+parser.add_argument("--shadow-resync", action="store", type=float, dest="shadowResync", default=GreengrassAwareConnection.RESYNC_INTERVAL, help="seconds between shadow updates with the whole state -- in between only changed keys are sent")
+parser.add_argument("--deadband", action="append", dest="deadbands", default=[], help="KEY=AMOUNT only reports KEY once it has moved more than AMOUNT from the reported value, e.g. pumpWatts=10 (repeatable)")
+parser.add_argument("--min-interval", action="append", dest="minIntervals", default=[], help="KEY=SECONDS reports KEY at most once every SECONDS (repeatable)")
+parser.add_argument("--shadow-window", action="store", type=int, dest="shadowWindow", default=GreengrassAwareConnection.MAX_IN_FLIGHT, help="shadow updates waiting for an answer at a time -- beyond that newer states are merged into one to send next")
+parser.add_argument("--telemetry", action="append", dest="telemetry", default=[], help="KEY=SECONDS samples KEY every SECONDS into batched time series on thingName/t instead of the shadow, e.g. pumpWatts=1 (repeatable)")
+parser.add_argument("--telemetry-interval", action="store", type=float, dest="telemetryInterval", default=TelemetryChannel.PUBLISH_INTERVAL, help="seconds of telemetry samples per message")
+parser.add_argument("--encoding", action="store", dest="encoding", default="json", choices=list(ENCODERS), help="encoding of raw payloads, telemetry and stats messages (shadow updates are always json) -- see MessageDecoder.py")
+parser.add_argument("--publish-interval", action="store", type=float, dest="publishInterval", default=1.0, help="with --async, minimum seconds between shadow publishes")
+parser.add_argument("--observers", action="store_true", help="process through the chain of observers (deframer, parser, aggregator) instead of the fused pipeline")
 
 
 #
@@ -151,6 +215,11 @@ parser.add_argument("-t", "--timeout", action="store", required=True, dest="time
 parser.add_argument("--csv", action="store_true", help="print every frame in csv, append parsed")
 # mqtt publish...
 parser.add_argument("--raw", action="store_true", help="publish raw payloads on parsed topics")
+parser.add_argument("--raw-match", action="append", dest="rawMatches", default=[], help="with --raw, only publish frames matching TYPE/DST/SRC/CMD in hex, * for any -- e.g. */*/60/* for the pump (repeatable)")
+parser.add_argument("--record", action="store", dest="recordFile", default="", help="append every read to this timestamped, indexed capture file")
+parser.add_argument("--flight", action="store", type=float, dest="flightSeconds", default=0, help="keep this many seconds of raw traffic in memory and dump it to a capture when a trigger fires")
+parser.add_argument("--flight-bytes", action="store", type=int, dest="flightBytes", default=65536, help="flight recorder memory in bytes")
+parser.add_argument("--flight-trigger", action="append", dest="flightTriggers", default=[], help="STAT=COUNT dumps the flight recorder when a stat reaches COUNT in one tick (default badFrames=5, unackedCommands=1)")
 
 args = parser.parse_args()
 host = args.host
@@ -163,49 +232,124 @@ inFile = args.inFile
 timeout = float(args.timeout)
 csv = args.csv
 
+# the ways of reading the serial port don't mix, and don't apply to a file
+if args.useAsync and args.useThread:
+    parser.error('--async and --thread are two ways of reading the serial port -- use one')
+if len(inFile) > 0 and (args.useAsync or args.useThread):
+    parser.error('--async and --thread read the serial port -- they do not apply to -i')
+if not args.useAsync and args.publishInterval != parser.get_default('publishInterval'):
+    logger.warning('--publish-interval only applies with --async')
+if not args.useThread and args.ringBytes != parser.get_default('ringBytes'):
+    logger.warning('--ring-bytes only applies with --thread')
+
+# KEY=VALUE arguments -> { KEY: VALUE }
+def keyValues(arguments):
+    values = {}
+    for a in arguments:
+        k, v = a.split('=')
+        values[k] = float(v)
+
+    return values
+
+# a key sampled every 0 seconds would always be due
+telemetryIntervals = keyValues(args.telemetry)
+for k, seconds in telemetryIntervals.items():
+    if seconds <= 0:
+        parser.error(f'--telemetry {k}={seconds:g} -- the interval must be more than 0 seconds')
+
 
 '''
-Reader -> streamData --> MessageParser -> messages -> FrameParser -> frames -> Output
+Reader -> streamData --> FusedPipeline -> state
+                                       -> frames -> Output
+
+or with --observers
+
+Reader -> streamData --> StreamDeframer -> messages -> FrameParser -> frames -> StateAggregator -> state
+                                                                            -> Output
+
+with --thread the FusedPipeline is exact, and FrameSplitter takes the place of StreamDeframer -- the
+BusReader has deframed and checked the frames on its own thread
 '''
 
 # streamData is an Observable to connect the raw stream from connection to downstream observers
 streamData = ObservableString()
 messages = ObservableArray()
 frames = ObservableArray()
-state = ObservableDict()
+# the date keys are only for --csv
+state = StateStore(PAYLOADS.allKeys() - set(DATE_KEYS))
 
 
 
 outputConnection = None
 if len(inFile) > 0:
     print(f'using {inFile} as source')
-    connection = FileReader(inFile)
+    connection = FileReader(inFile, args.chunkSize, args.speed, args.fromTime, args.toTime)
 else:
     port = args.port
     print(f'using {port} as source')
-    connection = SerialConnection(port)
+    if args.useThread:
+        connection = BusReader(SerialConnection(port), args.ringBytes)
+        if len(args.recordFile) > 0 or args.flightSeconds > 0:
+            logger.warning('with --thread, captures only get the frames the reader completed, not the line noise')
+    elif args.useAsync:
+        connection = AsyncSerialConnection(port)
+    else:
+        connection = SerialConnection(port)
     outputConnection = connection
 
     timeout = float(args.timeout)
 # connection will read from either sourcse
 
 
-# messageParser will chop the stream into separate messages
-messageParser = MessageParser(PentairProtocol.RECORD_SEPARATOR, messages)
-# connect messageParser as an oberver of streamData
-streamData.addObserver(messageParser)
-
 protocol = PentairProtocol()
-frameParser = FrameParser(frames, protocol)
-messages.addObserver(frameParser)
+stateKeys = state.keys
+
+# with --thread the reader has already cut out and checked the frames -- they only need splitting apart
+if args.observers:
+    # messageParser will chop the stream into whole frames, carrying partials between reads
+    if args.useThread:
+        messageParser = FrameSplitter(messages, protocol)
+    else:
+        messageParser = StreamDeframer(messages, protocol)
+    # connect messageParser as an oberver of streamData
+    streamData.addObserver(messageParser)
+
+    frameParser = FrameParser(frames, protocol, padded=False, checked=args.useThread)
+    messages.addObserver(frameParser)
+
+    stateAggregator = StateAggregator(state, stateKeys)
+    frameParser.addFrameObserver(stateAggregator)
+else:
+    # one pass from raw bytes to state -- frameParser only collects frames if someone observes them
+    frameParser = FusedPipeline(state, protocol, stateKeys, exact=args.useThread)
+    streamData.addObserver(frameParser)
 
-state = ObservableDict()
-stateAggregator = StateAggregator(state)
-frames.addObserver(stateAggregator)
+# output observers subscribe to the frames they want through the router
+router = None
+if csv or args.raw:
+    router = FrameRouter(protocol)
+    frameParser.addFrameObserver(router)
 
 if csv:
     output = CSVOutput()
-    frames.addObserver(output)
+    router.subscribe(output)
+
+recorder = None
+if len(args.recordFile) > 0:
+    recorder = CaptureRecorder(args.recordFile)
+    streamData.addObserver(recorder)
+
+flightRecorder = None
+if args.flightSeconds > 0:
+    triggers = None
+    if len(args.flightTriggers) > 0:
+        triggers = {}
+        for t in args.flightTriggers:
+            k, count = t.split('=')
+            triggers[k] = int(count)
+
+    flightRecorder = FlightRecorder(args.flightSeconds, args.flightBytes, triggers=triggers)
+    streamData.addObserver(flightRecorder)
 
 
 '''
@@ -235,71 +379,260 @@ outputWriter = OutputWriter(outputConnection)
 commandStreams.addObserver(outputWriter)
 
 
+# KEY=VALUE arguments as a dict
+iotConnection = None
 try:
-    iotConnection = GreengrassAwareConnection(host, rootCA, cert, key, thingName, deltas)
+    iotConnection = GreengrassAwareConnection(host, rootCA, cert, key, thingName, deltas, args.shadowResync,
+                                              keyValues(args.deadbands), keyValues(args.minIntervals), args.shadowWindow)
 
     iotConnection.deleteShadow()
 except Exception as e:
     logger.error(f'{str(type(e))} Error')
 
+encoder = ENCODERS[args.encoding]()
+
 if args.raw:
-    publisher = MQTTPublisher(iotConnection, thingName + "/raw")
-    frames.addObserver(publisher)
+    publisher = MQTTPublisher(iotConnection, thingName + "/raw", encoder)
+    for m in (args.rawMatches or ['*/*/*/*']):
+        router.subscribe(publisher, *[None if x == '*' else int(x, 16) for x in m.split('/')])
 
+telemetry = None
+if len(args.telemetry) > 0:
+    telemetry = TelemetryChannel(iotConnection, thingName + '/t', state, telemetryIntervals, args.telemetryInterval,
+                                 encoder)
 
-def do_something():
-    if not connection.isOpen():
-        connection.open()
 
-    streamData.append(connection.listen())
+# streamData is fed by the main loop, and by OutputWriter on the SDK's delta callback thread -- the
+# deframer carries a partial frame from one read to the next, so only one read at a time
+streamLock = threading.Lock()
 
-    accState = state.getDict()
-    for k in ['hour', 'min', 'dow', 'day', 'month', 'year', 'adjust', 'dst']:
-        if k in accState:
-            accState.pop(k)
-    
-    # segregate immutable properties to a telemetry update
-    telemetry = {}
-    # for k in ['airTemp', 'solarTemp', 'spaTemp', 'tempUnits', 'timeout', 'waterTemp', 'pumpRPM', 'pumpWatts']:
-    #     if k in accState:
-    #         telemetry[k] = accState.pop(k)
+def readConnection():
+    with streamLock:
+        streamData.append(connection.listen())
 
-    if len(accState) > 0:
-        try:
-            stateMessage = json.dumps(accState)
-            logger.info(stateMessage)
-            iotConnection.updateShadow(accState)
-        except Exception as e:
-            logger.warn("Exception updating Shadow " + e)
+def do_something():
+    if not connection.isOpen():
+        connection.open()
 
-    if len(telemetry) > 0:
+    readConnection()
+    if telemetry is not None:
+        telemetry.sample()
+
+    publish(*takeChanges())
+    publishTelemetry()
+    publishStats(takeStats())
+
+
+# state version the shadow has been offered up to
+seen = 0
+
+# (the state keys changed since the last call, True if that is the whole state) -- the whole state
+# to start with and whenever the shadow is due a resync
+def takeChanges():
+    global seen
+    complete = seen == 0 or (iotConnection is not None and iotConnection.resyncDue())
+    changes, seen = state.changedSince(0 if complete else seen)
+
+    return (changes, complete)
+
+# returns a copy of the stats for this period and starts the next one
+def takeStats():
+    # not while a read on another thread is counting
+    with streamLock:
+        protocol.checkAcks(ACK_TIMEOUT)
+        stats = dict(protocol.getStats())
+        protocol.resetStats()
+
+    # with --thread the corrupted spans are found (and counted) by the reader
+    if isinstance(connection, BusReader):
+        for k, v in connection.takeStats().items():
+            stats[k] = stats.get(k, 0) + v
+
+    if flightRecorder is not None:
+        dumpFile = flightRecorder.check(stats)
+        if dumpFile is not None:
+            logger.warning(f'flight recorder dumped to {dumpFile}')
+
+    try:
+        stats.update(iotConnection.takeStats())
+    except Exception as e:
+        pass
+
+    if telemetry is not None:
+        stats.update(telemetry.takeStats())
+
+    return stats
+
+
+# sends what changed in state (see takeChanges) -- safe to call off the thread that is updating it
+def publish(changes, complete):
+    # the telemetry keys go out as time series instead
+    if telemetry is not None:
+        for k in telemetry.keys():
+            changes.pop(k, None)
+
+    try:
+        if len(changes) > 0:
+            logger.info(json.dumps(changes))
+        # even with no changes -- keys held back or failed before may be due
+        iotConnection.updateShadow(changes, complete)
+    except Exception as e:
+        logger.warn("Exception updating Shadow " + str(e))
+        # offer the whole state again next time
+        global seen
+        seen = 0
+
+# sends the telemetry samples once a message is due
+def publishTelemetry():
+    if telemetry is not None and telemetry.publishDue():
         try:
-            telemetryMessage = json.dumps(telemetry)
-            logger.info(telemetryMessage)
-            iotConnection.publishMessageOnTopic(telemetryMessage, thingName + '/t')
+            telemetry.publish()
         except Exception as e:
-            logger.warn("Exception sending telemetry " + e)
+            logger.warn("Exception sending telemetry " + str(e))
 
-    stats = json.dumps(protocol.getStats())
+# sends the stats from takeStats -- safe to call off the thread that is updating them
+def publishStats(stats):
     if len(stats) > 0:
         try:
-            logger.info(stats + "\n")
-            iotConnection.publishMessageOnTopic(stats, thingName + '/s')
+            logger.info(json.dumps(stats) + "\n")
+            iotConnection.publishMessageOnTopic(encoder.encode(stats), thingName + '/s')
         except Exception as e:
-            logger.warn("Exception sending stats " + e)
-
-    protocol.resetStats()
-
+            logger.warn("Exception sending stats " + str(e))
+
+
+# sends the shadow update queued behind a full --shadow-window -- from the publishing thread, never
+# the SDK's callback
+def sendQueued():
+    try:
+        iotConnection.sendQueued()
+    except Exception as e:
+        logger.warn("Exception sending queued shadow update " + str(e))
+
+# reads what has arrived and samples the telemetry that is due -- between ticks, so --telemetry
+# intervals shorter than -t are kept without --async
+def sampleTelemetry():
+    # a file is replayed a chunk per tick -- reading it more often would just replay it faster
+    if outputConnection is not None:
+        readConnection()
+    telemetry.sample()
+    publishTelemetry()
+
+# sleeps for seconds -- sending a queued shadow update as soon as an answer makes room for it, and
+# waking for telemetry samples that fall due
+def waitFor(seconds):
+    end = time.monotonic() + seconds
+    while True:
+        left = end - time.monotonic()
+        if left <= 0:
+            return
+
+        if telemetry is not None:
+            due = telemetry.untilDue()
+            if due <= 0:
+                sampleTelemetry()
+                continue
+            left = min(left, due)
+
+        if iotConnection is None:
+            time.sleep(left)
+        elif iotConnection.windowOpen.wait(left):
+            sendQueued()
 
 def run():
     if not connection.isOpen():
         connection.open()
 
     while True:
-        time.sleep(timeout)         # crude approach to timing adjustment
+        waitFor(timeout)            # crude approach to timing adjustment
         do_something()
 
-if __name__ == "__main__":
 
-    # do_something(connection, protocol)
-    run()
+# sets an asyncio.Event whenever the observed thing changes
+class ChangeNotifier(Observer):
+    def __init__(self, event):
+        super().__init__()
+        self.event = event
+
+    def update(self, arg):
+        self.event.set()
+
+#
+# asyncio version of run() -- the connection feeds streamData from the loop as bytes arrive, so state
+# is current within milliseconds.  Publishing is its own coroutine: it wakes when state changes (or
+# after IDLE_PUBLISH_INTERVAL, as repeated frames don't change it), sends the changes from an executor
+# thread (so a slow broker never holds up the reads) and then waits at least publishInterval before the
+# next one.  Stats go out on their own timer.
+#
+async def publishLoop(changed):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            await asyncio.wait_for(changed.wait(), IDLE_PUBLISH_INTERVAL)
+        except asyncio.TimeoutError as e:
+            pass
+        changed.clear()
+
+        await loop.run_in_executor(None, publish, *takeChanges())
+        await asyncio.sleep(args.publishInterval)
+
+# stats, ACK timeouts and the flight recorder triggers once a tick (-t), as without --async -- whether
+# state changes or not
+async def statsLoop():
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep(timeout)
+        await loop.run_in_executor(None, publishStats, takeStats())
+
+# samples telemetry on its own schedule -- publishLoop only wakes on changes
+async def telemetryLoop():
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep(telemetry.untilDue())
+        telemetry.sample()
+        if telemetry.publishDue():
+            await loop.run_in_executor(None, publishTelemetry)
+
+# waits for answers that make room for a queued shadow update, off the loop
+async def shadowWindowLoop():
+    loop = asyncio.get_running_loop()
+
+    while True:
+        # with a timeout, so the executor thread is free again when the loop shuts down
+        if await loop.run_in_executor(None, iotConnection.windowOpen.wait, 1):
+            await loop.run_in_executor(None, sendQueued)
+
+async def runAsync():
+    if not connection.isOpen():
+        connection.open()
+
+    changed = asyncio.Event()
+    state.addObserver(ChangeNotifier(changed))
+
+    loops = [publishLoop(changed), statsLoop()]
+    if telemetry is not None:
+        loops.append(telemetryLoop())
+    if iotConnection is not None:
+        loops.append(shadowWindowLoop())
+
+    connection.attach(streamData)
+    try:
+        await asyncio.gather(*loops)
+    finally:
+        connection.detach()
+
+if __name__ == "__main__":
+    # stopping the service should close the capture like ^C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        # do_something(connection, protocol)
+        if isinstance(connection, AsyncSerialConnection):
+            asyncio.run(runAsync())
+        else:
+            run()
+    finally:
+        if recorder is not None:
+            recorder.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+#
+# pentair-decode.py
+#
+#   Decodes a whole raw stream or timestamped capture offline, in shards across all cores, and writes
+#   every frame as CSV (the same lines as pentair-control.py --csv) and optionally the state timeline
+#   -- frame number, then the keys that frame changed as json. The output is identical to decoding
+#   the file in one sequential pass (--jobs 1).
+#
+#       ./pentair-decode.py -i capture.bin -o frames.csv --states states.csv
+#
+#   Shards are merged back in order as they complete; see ShardDecoder for how they are cut and how a
+#   frame running across a cut is handled.
+#
+from ShardDecoder import decodeShard, inSync, openSource
+
+import argparse
+import json
+from multiprocessing import Pool
+import os
+import sys
+import time
+
+
+# stats that depend on how the file was split up
+LOCAL_STATS = ('cacheHits', 'cacheMisses')
+
+
+# writes shard results, in order, as if the whole file had been decoded at once
+class ShardMerger:
+    def __init__(self, csvFile, statesFile):
+        self.csvFile = csvFile
+        self.statesFile = statesFile
+
+        self.state = {}
+        self.frames = 0
+        self.stats = {}
+
+    def add(self, result):
+        if self.csvFile is not None:
+            self.csvFile.write(result['csv'])
+
+        # a shard reports every key the first time it sees it -- only some of those are changes
+        for i, changed in result['changes']:
+            changed = { k: v for k, v in changed.items() if k not in self.state or self.state[k] != v }
+            if len(changed) > 0:
+                self.state.update(changed)
+                if self.statesFile is not None:
+                    self.statesFile.write(f'{self.frames + i},{json.dumps(changed)}\n')
+
+        self.frames += result['frames']
+        for k, v in result['stats'].items():
+            if k not in LOCAL_STATS:
+                self.stats[k] = self.stats.get(k, 0) + v
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--inputfile", action="store", required=True, dest="inFile", help="raw protocol stream or timestamped capture to decode")
+parser.add_argument("-o", "--output", action="store", dest="output", default="-", help="csv file for the frames, - for stdout, empty for none")
+parser.add_argument("--states", action="store", dest="states", default="", help="csv file for the state timeline")
+parser.add_argument("--jobs", action="store", type=int, dest="jobs", default=os.cpu_count(), help="processes to decode with (default one per core, 1 decodes sequentially)")
+parser.add_argument("--shard", action="store", type=int, dest="shardSize", default=4 << 20, help="bytes per shard")
+
+args = parser.parse_args()
+
+
+def openOutput(name):
+    if name == '-':
+        return sys.stdout
+    if len(name) > 0:
+        return open(name, 'w')
+    return None
+
+
+if __name__ == "__main__":
+    source = openSource(args.inFile)
+    shards = source.shards(args.shardSize)
+    source.close()
+
+    csv = len(args.output) > 0
+    jobs = [(args.inFile, start, end, i == 0, csv) for i, (start, end) in enumerate(shards)]
+
+    csvFile = openOutput(args.output)
+    statesFile = openOutput(args.states)
+    merger = ShardMerger(csvFile, statesFile)
+
+    begin = time.perf_counter()
+    redone = 0
+    previous = None
+
+    if args.jobs <= 1:
+        # one shard after the other, each carrying on from where the last left the deframer
+        for job in jobs:
+            previous = decodeShard(job, previous)
+            merger.add(previous)
+    else:
+        with Pool(args.jobs) as pool:
+            for job, result in zip(jobs, pool.imap(decodeShard, jobs)):
+                # a frame ran across the cut -- this shard has to carry on from the last one
+                if previous is not None and not inSync(previous):
+                    result = decodeShard(job, previous)
+                    redone += 1
+
+                merger.add(result)
+                previous = result
+
+    elapsed = time.perf_counter() - begin
+
+    for f in (csvFile, statesFile):
+        if f is not None and f is not sys.stdout:
+            f.close()
+
+    print(json.dumps({  'frames': merger.frames,
+                        'shards': len(jobs),
+                        'redoneShards': redone,
+                        'seconds': round(elapsed, 3),
+                        **merger.stats }), file=sys.stderr)
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+#
+# pentair-sim.py
+#
+#   EasyTouch bus simulator on a pseudo-terminal.  Prints the device to hand to pentair-control.py, e.g.
+#
+#       ./pentair-sim.py --rate 10 --noise 0.01 &
+#       ./pentair-control.py ... --port /dev/pts/N -t 0.1
+#
+from EasyTouchSimulator import EasyTouchSimulator, openPty
+
+import argparse
+import json
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rate", action="store", type=float, dest="rate", default=1.0, help="frame rate multiplier -- 1 is a real controller, 100 broadcasts 100x as often")
+parser.add_argument("--noise", action="store", type=float, dest="noise", default=0.0, help="probability (0-1) of corrupting each frame")
+parser.add_argument("--duration", action="store", type=float, dest="duration", default=None, help="seconds to run (default forever)")
+parser.add_argument("--seed", action="store", type=int, dest="seed", default=None, help="random seed for repeatable runs")
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    master, slave, device = openPty()
+    print(f'simulating EasyTouch on {device}', flush=True)
+
+    simulator = EasyTouchSimulator(args.rate, args.noise, args.seed)
+    try:
+        simulator.run(master, args.duration)
+    except KeyboardInterrupt as e:
+        pass
+
+    print(json.dumps(simulator.stats))